@@ -0,0 +1,128 @@
+"""
+headless batch rendering of infinite mirror images
+
+a manifest is a json list (or a file with one json object per line) of jobs:
+
+    {"input": "in.jpg", "output": "out.jpg",
+     "window": [[x0,y0],[x1,y1],[x2,y2],[x3,y3]],
+     "mask": "mask.png", "depth": 4, "method": "iterative", "corner": "sharp"}
+
+"window" is given in image pixel coordinates, "mask", "depth", "method" and "corner"
+are optional, see RecursionEngine.render for the available methods
+"depth" may be "auto", optionally with "min_area", the smallest window in pixels
+"encoder" optionally overrides ImageIO.DEFAULT_OPTIONS, e.g. {"jpeg_quality": 85}
+"""
+import cv2
+import json
+import time, sys
+import argparse
+import multiprocessing as mp
+from engine import RecursionEngine
+from fileio import ImageIO
+
+DEFAULT_DEPTH = 4
+DEFAULT_METHOD = "iterative"
+
+def load_manifest(path):
+    """
+    returns the list of jobs in the manifest at path
+    """
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def render_job(job):
+    """
+    load, render and save a single job
+    returns a dict of timings for the job, or the error if it failed
+    """
+    result = {"input": job.get("input"), "output": job.get("output")}
+    try:
+        t0 = time.perf_counter()
+        image = cv2.imread(job["input"])
+        if image is None:
+            raise IOError("Could not read image: %s" % job["input"])
+        mask = None
+        if job.get("mask"):
+            mask = ImageIO.read_mask(job["mask"])
+            if mask is None:
+                raise IOError("Could not read mask: %s" % job["mask"])
+        t1 = time.perf_counter()
+
+        engine = RecursionEngine(image, mask)
+        draw = engine.render(job["window"], job.get("depth", DEFAULT_DEPTH),
+                             job.get("method", DEFAULT_METHOD), job.get("min_area", 1.0),
+                             job.get("corner", "sharp"))
+        t2 = time.perf_counter()
+
+        ImageIO.write(job["output"], draw, job.get("encoder"))
+        t3 = time.perf_counter()
+
+        result.update(ok=True, load=t1-t0, render=t2-t1, save=t3-t2, total=t3-t0,
+                      megapixels=image.shape[0]*image.shape[1]/1e6)
+    except Exception as e:
+        result.update(ok=False, error="%s: %s" % (type(e).__name__, e))
+    return result
+
+def run_batch(jobs, processes=None, maxtasksperchild=16, callback=None):
+    """
+    render all jobs across a pool of worker processes
+
+    images are only ever decoded inside the workers and results are just timings,
+    so peak memory is bounded by the number of processes times the largest job
+    workers are recycled after maxtasksperchild jobs to release fragmented memory
+
+    callback, if given, is called with each job's result as it completes
+    returns (results, summary)
+    """
+    results = []
+    start = time.perf_counter()
+    with mp.Pool(processes, maxtasksperchild=maxtasksperchild) as pool:
+        for result in pool.imap_unordered(render_job, jobs, chunksize=1):
+            results.append(result)
+            if callback is not None:
+                callback(result)
+    elapsed = time.perf_counter() - start
+
+    done = [res for res in results if res["ok"]]
+    summary = {
+        "jobs": len(results),
+        "failed": len(results) - len(done),
+        "elapsed": elapsed,
+        "jobs_per_sec": len(done)/elapsed if elapsed else 0.0,
+        "megapixels_per_sec": sum(res["megapixels"] for res in done)/elapsed if elapsed else 0.0,
+    }
+    return results, summary
+
+def print_result(result):
+    if result["ok"]:
+        print("%-40s load %7.3fs  render %7.3fs  save %7.3fs  total %7.3fs"
+              % (result["output"], result["load"], result["render"], result["save"], result["total"]))
+    else:
+        print("%-40s FAILED  %s" % (result["output"], result["error"]), file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render infinite mirror images in batch")
+    parser.add_argument("manifest", help="json manifest of render jobs")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--maxtasks", type=int, default=16,
+                        help="jobs per worker before it is recycled")
+    parser.add_argument("--report", help="write per-job timings and summary as json")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    results, summary = run_batch(jobs, args.processes, args.maxtasks, print_result)
+    print("%d jobs (%d failed) in %.2fs: %.2f jobs/s, %.2f MP/s"
+          % (summary["jobs"], summary["failed"], summary["elapsed"],
+             summary["jobs_per_sec"], summary["megapixels_per_sec"]))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"summary": summary, "jobs": results}, f, indent=2)
+    return 1 if summary["failed"] else 0
+
+if __name__=="__main__":
+    sys.exit(main())
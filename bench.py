@@ -0,0 +1,235 @@
+"""
+benchmark suite for the recursion pipeline
+
+    python bench.py run -o results.json
+    python bench.py compare baseline.json results.json
+
+run sweeps the example images and synthetic images of the given sizes over
+recursion depth, corner interpolation, window size and the interpolation the
+warp and remap paths sample with, and also times the canvas
+conversion of TkDisplay and Polygon.render, every case runs in a fresh worker
+process so its peak RSS is its own, results are written as json
+
+compare matches the cases of two runs and flags those whose median latency
+grew by more than the threshold, exiting with 1 if any did
+"""
+import os
+import cv2
+import json
+import time, sys
+import timeit
+import argparse
+import platform
+import resource
+import itertools
+import multiprocessing as mp
+import numpy as np
+from display import TkDisplay
+from engine import RecursionEngine
+from polygon import Polygon
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples", "input")
+CANVAS = (960, 640)     # (w,h) canvas size the display conversion scales to
+
+def synthetic_image(megapixels, seed=0):
+    """
+    returns a 4:3 BGR image of about the given size, smooth gradients with
+    noise on top so it is neither flat nor incompressible
+    """
+    h = int(round(np.sqrt(megapixels*1e6*3/4)))
+    w = int(round(h*4/3))
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, w, dtype=np.float32)
+    y = np.linspace(0, 255, h, dtype=np.float32)[:,None]
+    image = np.empty((h,w,3), dtype=np.uint8)
+    image[...,0] = (x + 0*y).astype(np.uint8)
+    image[...,1] = (0*x + y).astype(np.uint8)
+    image[...,2] = ((x + y)/2).astype(np.uint8)
+    noise = rng.integers(0, 32, (h,w), dtype=np.uint8)
+    cv2.add(image, cv2.merge([noise]*3), dst=image)
+    return image
+
+def load_source(source):
+    """ returns the image of a source, an example file name or "synthetic:<megapixels>" """
+    if source.startswith("synthetic:"):
+        return synthetic_image(float(source.split(":", 1)[1]))
+    image = cv2.imread(os.path.join(EXAMPLES, source))
+    if image is None:
+        raise IOError("Could not read image: %s" % source)
+    return image
+
+def window_quad(size, fraction):
+    """
+    returns a slightly skewed window covering about fraction of the frame's
+    width and height, centered in a frame of the given size (w,h)
+    """
+    c,r = size
+    hw, hh = c*fraction/2, r*fraction/2
+    cx, cy = c/2, r/2
+    return [[cx-hw, cy-hh], [cx+hw, cy-0.9*hh], [cx+0.95*hw, cy+hh], [cx-hw, cy+0.95*hh]]
+
+def time_calls(fn, repeat):
+    """ returns the sorted latencies in seconds of repeat calls of fn, after one warmup call """
+    fn()
+    return sorted(timeit.repeat(fn, number=1, repeat=repeat))
+
+def percentile(times, p):
+    return float(np.percentile(times, p))
+
+def run_case(case):
+    """
+    runs a single benchmark case, returns the case with its results added
+    """
+    result = dict(case)
+    kind = case["bench"]
+    rss_base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if kind == "render":
+        image = load_source(case["image"])
+        r,c = image.shape[:2]
+        engine = RecursionEngine(image, interpolation=case["interpolation"])
+        quad = window_quad((c,r), case["quad"])
+        depth = case["depth"]
+        if depth == "auto":
+            depth = engine.adaptive_depth(engine.homography(quad, case["corner"]))
+        fn = lambda: engine.render(quad, depth, case["method"], corner=case["corner"])
+        pixels = r*c
+        result["resolved_depth"] = depth
+    elif kind == "display":
+        image = load_source(case["image"])
+        r,c = image.shape[:2]
+        display = TkDisplay(CANVAS)
+        # everything but the paste into the PhotoImage, which needs a display
+        fn = lambda: display.convert(image)
+        pixels = r*c
+    elif kind == "polygon":
+        rng = np.random.default_rng(0)
+        poly = Polygon(rng.uniform(0, 1000, (case["points"], 2)))
+        fn = lambda: poly.render(case["corner"], flat=True)
+        pixels = 0
+    else:
+        raise ValueError("Invalid benchmark: %s" % kind)
+
+    times = time_calls(fn, case["repeat"])
+    median = percentile(times, 50)
+    result.update(median_ms=1000*median, p95_ms=1000*percentile(times, 95),
+                  min_ms=1000*times[0], megapixels=pixels/1e6,
+                  mp_per_sec=pixels/1e6/median if pixels and median else 0.0,
+                  # ru_maxrss is in kilobytes on linux
+                  peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024,
+                  base_rss_mb=rss_base/1024)
+    return result
+
+def make_cases(args):
+    """ returns the list of cases swept by the run arguments """
+    sources = [name for name in sorted(os.listdir(EXAMPLES)) if not args.no_examples]
+    sources += ["synthetic:%g" % size for size in args.sizes]
+    depths = [d if d == "auto" else int(d) for d in args.depths]
+    cases = []
+    for source, method, depth, corner, quad, interpolation in itertools.product(
+            sources, args.methods, depths, args.corners, args.quads, args.interpolations):
+        cases.append({"bench": "render", "image": source, "method": method, "depth": depth,
+                      "corner": corner, "quad": quad, "interpolation": interpolation,
+                      "repeat": args.repeat})
+    for source in sources:
+        cases.append({"bench": "display", "image": source, "repeat": args.repeat})
+    for corner, points in itertools.product(args.corners, (4, 8, 16)):
+        cases.append({"bench": "polygon", "corner": corner, "points": points,
+                      "repeat": max(args.repeat, 20)})
+    return cases
+
+def case_key(result):
+    """ returns what identifies a case across runs """
+    # runs from before the interpolation was swept rendered linearly
+    interpolation = "linear" if result["bench"] == "render" else None
+    return tuple((k, str(result.get(k, interpolation if k == "interpolation" else None))) for k in
+                 ("bench", "image", "method", "depth", "corner", "quad", "interpolation", "points"))
+
+def run(args):
+    cases = make_cases(args)
+    results = []
+    start = time.perf_counter()
+    # a fresh process per case keeps each peak rss separate
+    with mp.Pool(1, maxtasksperchild=1) as pool:
+        for n, result in enumerate(pool.imap(run_case, cases, chunksize=1)):
+            results.append(result)
+            print("[%3d/%d] %-60s median %9.2fms  p95 %9.2fms  %7.1f MP/s  %7.1f MB"
+                  % (n+1, len(cases), describe(result), result["median_ms"], result["p95_ms"],
+                     result["mp_per_sec"], result["peak_rss_mb"]))
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "elapsed": time.perf_counter() - start,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("wrote %d results to %s" % (len(results), args.output))
+    return 0
+
+def describe(result):
+    return " ".join([result["bench"]] + ["%s=%s" % (k, v) for k, v in case_key(result)[1:] if v != "None"])
+
+def compare(args):
+    with open(args.baseline) as f:
+        old = {case_key(res): res for res in json.load(f)["results"]}
+    with open(args.current) as f:
+        new = {case_key(res): res for res in json.load(f)["results"]}
+
+    regressions = 0
+    print("%-60s %10s %10s %8s" % ("case", "old ms", "new ms", "change"))
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key]["median_ms"], new[key]["median_ms"]
+        change = b/a - 1 if a else 0.0
+        flag = ""
+        if change > args.threshold and b - a > args.min_ms:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold and a - b > args.min_ms:
+            flag = "  improved"
+        print("%-60s %10.2f %10.2f %+7.1f%%%s" % (describe(new[key]), a, b, 100*change, flag))
+    for key in sorted(set(old) ^ set(new)):
+        print("%-60s only in %s" % (describe((old.get(key) or new.get(key))),
+                                    "baseline" if key in old else "current"))
+    print("%d regressions over %.0f%%" % (regressions, 100*args.threshold))
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recursion pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = sub.add_parser("run", help="run the benchmark sweep")
+    parser_run.add_argument("-o", "--output", default="bench.json", help="json file to write")
+    parser_run.add_argument("--sizes", type=float, nargs="*", default=[0.3, 2, 12, 50],
+                            help="megapixels of the synthetic images")
+    parser_run.add_argument("--depths", nargs="+", default=["2", "4", "8", "auto"],
+                            help="recursion depths, numbers or \"auto\"")
+    parser_run.add_argument("--corners", nargs="+", default=["sharp", "bezier", "hermite"],
+                            help="window corner interpolations")
+    parser_run.add_argument("--quads", type=float, nargs="+", default=[0.3, 0.6, 0.9],
+                            help="window sizes as fractions of the frame")
+    parser_run.add_argument("--interpolations", nargs="+", default=list(RecursionEngine.INTERPOLATIONS),
+                            choices=RecursionEngine.INTERPOLATIONS, help="warp and remap sampling")
+    parser_run.add_argument("--methods", nargs="+", default=["iterative"],
+                            choices=RecursionEngine.METHODS, help="render methods")
+    parser_run.add_argument("--repeat", type=int, default=7, help="timed calls per case")
+    parser_run.add_argument("--no-examples", action="store_true",
+                            help="skip the images in examples/input")
+
+    parser_cmp = sub.add_parser("compare", help="compare two runs")
+    parser_cmp.add_argument("baseline", help="json of the earlier run")
+    parser_cmp.add_argument("current", help="json of the later run")
+    parser_cmp.add_argument("--threshold", type=float, default=0.10,
+                            help="relative slowdown of the median flagged as a regression")
+    parser_cmp.add_argument("--min-ms", type=float, default=0.05,
+                            help="ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+speed of the numpy and opencl backends of the render methods that support both
+
+each method is timed rendering to a host array ("render"), and rendering then
+scaling the frame to the display size as TkDisplay.convert does ("display"),
+where the opencl backend keeps the frame on the device and only downloads the
+scaled frame, the first call of each is not timed, since it compiles the kernels
+
+without an OpenCL runtime only the numpy backend is timed
+"""
+import sys
+import timeit
+import argparse
+import cv2
+from engine import RecursionEngine
+from bench import load_source, window_quad
+
+def display(frame, size):
+    """ returns frame scaled to size as a host array """
+    scaled = cv2.resize(frame, size)
+    return scaled.get() if isinstance(scaled, cv2.UMat) else scaled
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the numpy and opencl render backends")
+    parser.add_argument("images", nargs="*", default=["tv.jpg", "synthetic:8", "synthetic:24"],
+                        help="example images or synthetic:<megapixels>")
+    parser.add_argument("--depth", type=int, default=8, help="recursion depth")
+    parser.add_argument("--quad", type=float, default=0.5, help="window size as a fraction of the frame")
+    parser.add_argument("--display", type=int, nargs=2, default=(1280, 720), help="display size w h")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per case")
+    args = parser.parse_args(argv)
+
+    backends = ["numpy"]
+    if RecursionEngine.opencl_available():
+        backends.append("opencl")
+        print("OpenCL device: %s" % cv2.ocl.Device.getDefault().name())
+    else:
+        print("OpenCL is not available, only timing the numpy backend")
+
+    print("%-16s %-10s %-8s %12s %12s" % ("image", "method", "backend", "render ms", "display ms"))
+    for source in args.images:
+        image = load_source(source)
+        r,c = image.shape[:2]
+        dst = window_quad((c,r), args.quad)
+        for method in RecursionEngine.UMAT_METHODS:
+            for backend in backends:
+                engine = RecursionEngine(image, backend=backend)
+                render = lambda: engine.render(dst, args.depth, method)
+                shown = lambda: display(engine.render(dst, args.depth, method, umat=True), tuple(args.display))
+                times = []
+                for fn in (render, shown):
+                    fn()
+                    times.append(min(timeit.repeat(fn, number=1, repeat=args.repeat)))
+                print("%-16s %-10s %-8s %12.2f %12.2f" % (source, method, backend, 1000*times[0], 1000*times[1]))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+micro-benchmark of the vectorized Polygon.render against per-sample evaluation
+"""
+import sys
+import timeit
+import numpy as np
+from polygon import Polygon
+
+def render_scalar(poly, corner):
+    """
+    evaluates the curve one t at a time with Polygon.bezier and Polygon.hermite,
+    the way Polygon.render used to
+    """
+    x, y = [], []
+    if corner == "bezier":
+        numsegs = (len(poly)+1)*Polygon.NUM_INTERP_SEGS
+        for segment in range(numsegs+1):
+            t = segment/numsegs
+            x.append(Polygon.bezier(poly.xpts, t))
+            y.append(Polygon.bezier(poly.ypts, t))
+    elif corner == "hermite":
+        for k in range(len(poly)-1):
+            for segment in range(Polygon.NUM_INTERP_SEGS+(k==len(poly)-2)):
+                t_k = segment / Polygon.NUM_INTERP_SEGS
+                x.append(Polygon.hermite(poly.xpts, t_k, k))
+                y.append(Polygon.hermite(poly.ypts, t_k, k))
+    return [x,y]
+
+def main(argv=None):
+    rng = np.random.default_rng(0)
+    print("%-8s %6s %12s %12s %9s %10s" % ("corner", "points", "scalar ms", "vector ms", "speedup", "max err"))
+    for corner in ("bezier", "hermite"):
+        for npts in (4, 8, 16, 32):
+            poly = Polygon(rng.uniform(0, 1000, (npts, 2)).tolist())
+            number = 20
+            scalar = timeit.timeit(lambda: render_scalar(poly, corner), number=number)/number
+            vector = timeit.timeit(lambda: poly.render(corner), number=number)/number
+            err = np.abs(np.array(render_scalar(poly, corner)) - np.array(poly.render(corner))).max()
+            print("%-8s %6d %12.3f %12.3f %8.1fx %10.2g"
+                  % (corner, npts, 1000*scalar, 1000*vector, scalar/vector, err))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+speed and quality of the render methods against a supersampled reference
+
+the reference samples every output pixel 4x4 times straight from the source
+through H^-k (the remap method on a 4x upscaled frame, area averaged back down),
+so it has neither the blur of repeated resampling nor the aliasing of point
+sampling deep levels, quality is the PSNR of each method against it
+
+"lanczos" is the full method with INTER_LANCZOS4 warps, as previous.py did
+"""
+import sys
+import timeit
+import argparse
+import numpy as np
+import cv2
+from engine import RecursionEngine
+from bench import load_source, window_quad
+
+SUPERSAMPLE = 4
+
+def render_lanczos(engine, dst, depth):
+    """ the full method warping every level with INTER_LANCZOS4 """
+    r,c = engine.imheight, engine.imwidth
+    hom = engine.homography(dst)
+    window = cv2.fillPoly(np.zeros((r,c), dtype=np.uint8), [np.int32(np.round(dst))], 255)
+    draw = engine.image.copy()
+    for i in range(depth):
+        warp = cv2.warpPerspective(draw, hom, (c,r), flags=cv2.INTER_LANCZOS4)
+        cv2.copyTo(warp, window, draw)
+    return draw
+
+def reference(image, dst, depth):
+    """
+    returns the render of every pixel averaged over SUPERSAMPLE x SUPERSAMPLE
+    samples taken straight from the source
+    """
+    r,c = image.shape[:2]
+    s = SUPERSAMPLE
+    big = cv2.resize(image, (c*s, r*s), interpolation=cv2.INTER_CUBIC)
+    engine = RecursionEngine(big)
+    draw = engine.render((np.array(dst, dtype=np.float64)*s).tolist(), depth, "remap")
+    return cv2.resize(draw, (c,r), interpolation=cv2.INTER_AREA)
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b)**2)
+    return 10*np.log10(255**2/mse) if mse else float("inf")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare render methods for speed and quality")
+    parser.add_argument("images", nargs="*", default=["tv.jpg", "synthetic:2"],
+                        help="example images or synthetic:<megapixels>")
+    parser.add_argument("--depth", type=int, default=8, help="recursion depth")
+    parser.add_argument("--quad", type=float, default=0.5, help="window size as a fraction of the frame")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per method")
+    args = parser.parse_args(argv)
+
+    print("%-16s %-10s %10s %10s" % ("image", "method", "ms", "psnr dB"))
+    for source in args.images:
+        image = load_source(source)
+        r,c = image.shape[:2]
+        dst = window_quad((c,r), args.quad)
+        ref = reference(image, dst, args.depth)
+        engine = RecursionEngine(image)
+        renders = {method: (lambda method=method: engine.render(dst, args.depth, method))
+                   for method in RecursionEngine.METHODS}
+        renders["lanczos"] = lambda: render_lanczos(engine, dst, args.depth)
+        for method, fn in renders.items():
+            draw = fn()
+            t = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+            print("%-16s %-10s %10.2f %10.2f" % (source, method, 1000*t, psnr(draw, ref)))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
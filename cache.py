@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+class RenderCache:
+    """
+    The RenderCache class is a least recently used cache of rendered arrays,
+    bounded by the total size in bytes of the arrays it holds
+
+    cached arrays are made read-only, since they are handed out without copying
+    """
+
+    def __init__(self, max_bytes=512*2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """
+        returns whether key is cached, without counting a hit or miss
+        """
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """
+        returns the array cached under key and marks it as recently used,
+        or None if it is not cached
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        caches the array value under key, evicting the least recently used
+        entries until everything fits, arrays larger than the cache are not kept
+        """
+        if value.nbytes > self.max_bytes:
+            return
+        value.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        returns a dict of the hit, miss and eviction counts and current size
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits/lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def content_hash(array):
+        """ returns a hex digest of the shape, type and contents of array """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str((array.shape, array.dtype.str)).encode())
+        h.update(memoryview(array if array.flags.c_contiguous else array.copy()).cast("B"))
+        return h.hexdigest()
@@ -0,0 +1,118 @@
+import cv2
+import math
+import contextlib
+import numpy as np
+from PIL import Image, ImageTk
+
+class TkDisplay:
+    """
+    The TkDisplay class shows frames through one persistent PhotoImage sized to
+    the canvas, rather than building a new PhotoImage for every frame
+
+    frames are scaled into a reused BGR buffer, the BGR -> RGB swap happens while
+    PIL unpacks that buffer into a reused image, and the image is pasted into the
+    PhotoImage in place, buffers are only reallocated when the size changes
+    """
+
+    def __init__(self, size, profiler=None):
+        self.size = None            # (w,h) - size of the displayed image
+        self.profiler = profiler    # Profiler - times the convert and paste stages, or None
+        self.allocations = 0        # int - number of times the buffers were reallocated
+        self._scaled = None         # np img - frame scaled to size, BGR
+        self._image = None          # PIL img - RGB image unpacked from _scaled
+        self._photo = None          # tk img - persistent photoimage, made on first use
+        self._source = None         # (h,w) - shape of the last frame converted in full, for patch
+        self.resize(size)
+
+    def resize(self, size):
+        """
+        reallocate the buffers for a new size (w,h), returns whether it changed,
+        the PhotoImage is replaced too, so canvas items need to be pointed at photo again
+        """
+        size = (max(int(size[0]), 1), max(int(size[1]), 1))
+        if size == self.size:
+            return False
+        self.size = size
+        self._scaled = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        self._image = Image.new("RGB", size)
+        self._photo = None
+        self._source = None
+        self.allocations += 1
+        return True
+
+    @property
+    def photo(self):
+        """ the PhotoImage frames are shown in, creating one needs a Tk root """
+        if self._photo is None:
+            self._photo = ImageTk.PhotoImage(self._image)
+        return self._photo
+
+    def convert(self, img):
+        """
+        returns the reused RGB PIL image holding the BGR np img scaled to size,
+        a cv2.UMat img is scaled on its device and only the scaled frame is downloaded
+        """
+        with self.span("convert"):
+            w,h = self.size
+            if isinstance(img, cv2.UMat):
+                scaled = cv2.resize(img, (w,h)).get()
+            elif img.shape[:2] == (h,w) and img.ndim == 3 and img.flags.c_contiguous:
+                scaled = img
+            else:
+                if img.ndim == 2:
+                    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+                scaled = cv2.resize(img, (w,h), dst=self._scaled)
+            self._image.frombytes(scaled.data, "raw", "BGR")
+            self._source = None if isinstance(img, cv2.UMat) else img.shape[:2]
+        return self._image
+
+    def show(self, img):
+        """
+        displays the BGR np img in photo, in place
+        """
+        image = self.convert(img)
+        with self.span("paste"):
+            self.photo.paste(image)
+        return self.photo
+
+    def patch(self, img, rect):
+        """
+        displays the BGR np img in photo like show, when only the rect (x,y,w,h)
+        of img changed since the last frame shown, only that part is scaled and
+        unpacked, though tk still copies the whole photo
+
+        cv2.resize samples display pixel d at (d+0.5)*c/W-0.5, a grid that repeats
+        every W/g display and c/g source pixels for g = gcd(W,c), so a block cut on
+        that period and resized on its own samples the same pixels with the same
+        weights as the full frame, and the patch matches a full scale exactly,
+        though a size coprime to the frame's makes the period the whole frame
+        """
+        if (not isinstance(img, np.ndarray) or img.ndim != 3 or img.shape[:2] != self._source
+                or tuple(rect) == (0, 0, img.shape[1], img.shape[0])):
+            return self.show(img)
+        with self.span("convert"):
+            x,y,w,h = rect
+            r,c = img.shape[:2]
+            W,H = self.size
+            # display pixels whose bilinear samples can touch rect
+            dx0, dy0 = max(int(np.floor(x*W/c))-1, 0), max(int(np.floor(y*H/r))-1, 0)
+            dx1, dy1 = min(int(np.ceil((x+w)*W/c))+1, W), min(int(np.ceil((y+h)*H/r))+1, H)
+            if dx1 <= dx0 or dy1 <= dy0:
+                return self.photo
+            # the periods around them, with a period of border for their samples
+            gx, gy = math.gcd(W,c), math.gcd(H,r)
+            qx, qy = W//gx, H//gy
+            kx0, ky0 = max(dx0//qx-1, 0), max(dy0//qy-1, 0)
+            kx1, ky1 = min(-(-dx1//qx)+1, gx), min(-(-dy1//qy)+1, gy)
+            block = img[ky0*(r//gy):ky1*(r//gy), kx0*(c//gx):kx1*(c//gx)]
+            scaled = cv2.resize(block, ((kx1-kx0)*qx, (ky1-ky0)*qy), interpolation=cv2.INTER_LINEAR)
+            ox, oy = dx0-kx0*qx, dy0-ky0*qy
+            scaled = np.ascontiguousarray(scaled[oy:oy+dy1-dy0, ox:ox+dx1-dx0])
+            region = Image.frombytes("RGB", (dx1-dx0, dy1-dy0), scaled.data, "raw", "BGR")
+            self._image.paste(region, (dx0, dy0))
+        with self.span("paste"):
+            self.photo.paste(self._image)
+        return self.photo
+
+    def span(self, name):
+        return self.profiler.span(name) if self.profiler is not None else contextlib.nullcontext()
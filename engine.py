@@ -0,0 +1,940 @@
+import cv2
+import copy
+import contextlib
+import numpy as np
+from cache import RenderCache
+from raster import ShapeRaster
+from masks import MaskLayer
+
+class RecursionEngine:
+    """
+    The RecursionEngine class performs the recursive infinite mirror operation
+    on an image, independently of any gui, so it can be driven by the editor
+    or by headless batch jobs
+    """
+
+    MAX_DEPTH = 64
+    QUANTUM = 0.25  # window corners closer than this in pixels share cached renders
+
+    def __init__(self, image, mask=None, cache=None, profiler=None, backend="numpy", interpolation="linear"):
+        self.image = None   # np img - unmodified source image, may be a np.memmap
+        self._mask = None   # np img - single channel alpha, 255 where the nested copy is kept, None keeps everything
+        self.masked = False # bool - whether the mask hides anything
+        self.soft = False   # bool - whether the mask has partially covered pixels
+        self.cache = cache  # RenderCache - shared cache of rendered frames and levels
+        self.image_key, self.mask_key = None, None  # str - content hashes for the cache
+        self.raster = ShapeRaster() # ShapeRaster - cached alpha masks of window outlines
+        self.profiler = profiler    # Profiler - records the time spent in each stage, or None
+        self.mipmaps = None         # [np img] - float32 source image halved at each level, built on first use
+        self.backend = "numpy"      # str - "opencl" keeps the frames of the iterative and full methods as cv2.UMat
+        self.interpolation = "linear"   # str - how the warp and remap paths sample, see INTERPOLATIONS
+        self._device = {}           # {name: cv2.UMat} - image and mask uploaded for the opencl backend
+        self._frame = None          # np img - frame kept by render_dirty, the image outside _window
+        self._window = None         # (x,y,w,h) - bounding box of the window _frame was rendered through
+        self.imwidth, self.imheight = 0, 0
+        self.set_image(image, mask)
+        self.set_backend(backend)
+        self.set_interpolation(interpolation)
+
+    def set_image(self, image, mask=None, keep_mask=False):
+        """
+        replace the source image, and reset the mask if none is given,
+        keep_mask keeps the current mask instead, without reducing and
+        scanning it again, for an image of the same shape such as the next
+        frame of a video
+        """
+        if keep_mask and (self.image is None or image.shape != self.image.shape):
+            raise ValueError("Image shape %s does not match the shape %s of the kept mask"
+                             % (image.shape, None if self.image is None else self.image.shape))
+        self.image = image
+        self.imheight, self.imwidth = image.shape[:2]
+        self.mipmaps = None
+        self._device.pop("image", None)
+        self._frame = None
+        if self.cache is not None:
+            self.image_key = RenderCache.content_hash(image)
+        if not keep_mask:
+            self.set_mask(mask)
+
+    def set_mask(self, mask=None, key=None, flags=None):
+        """
+        replace the mask applied to each nested copy
+        a mask of None keeps the whole image, 3 channel masks keep a pixel if
+        any channel is set and are stored as a single channel
+
+        a caller that already knows the mask's cache key and its (masked, soft)
+        flags, as a MaskLayer does, can pass them to skip hashing and scanning it
+        """
+        self._device.pop("mask", None)
+        if mask is None:
+            self.mask_key = "full"
+            self._mask, self.masked, self.soft = None, False, False
+            return
+        if mask.shape[:2] != (self.imheight, self.imwidth):
+            raise ValueError("Mask shape %s does not match image shape %s"
+                             % (mask.shape[:2], (self.imheight, self.imwidth)))
+        if mask.ndim == 3:
+            mask = mask.max(axis=2)
+        if self.cache is not None:
+            self.mask_key = key if key is not None else RenderCache.content_hash(mask)
+        self._mask = mask
+        self.masked, self.soft = flags if flags is not None else RecursionEngine.mask_flags(mask)
+
+    @property
+    def mask(self):
+        """
+        the mask applied to each nested copy, a full mask is only allocated
+        once something asks for it, remap_tables never does
+        """
+        if self._mask is None:
+            self._mask = np.full((self.imheight, self.imwidth), 255, dtype=np.uint8)
+        return self._mask
+
+    BACKENDS = ("numpy", "opencl")
+    def set_backend(self, backend):
+        """
+        choose between rendering on numpy arrays and on cv2.UMat frames, which
+        opencv's transparent api runs on an OpenCL device, falls back to numpy
+        when no OpenCL runtime is available, returns the backend in use
+        """
+        if backend not in RecursionEngine.BACKENDS:
+            raise ValueError("Invalid backend: %s" % backend)
+        if backend == "opencl" and not RecursionEngine.opencl_available():
+            backend = "numpy"
+        self.backend = backend
+        self._frame = None
+        return backend
+
+    # {name: (cv2 flag, source pixels the kernel reaches past the floor of a sample)}
+    INTERPOLATIONS = {"nearest": (cv2.INTER_NEAREST, 1), "linear": (cv2.INTER_LINEAR, 1),
+                      "cubic": (cv2.INTER_CUBIC, 2), "lanczos4": (cv2.INTER_LANCZOS4, 4)}
+    def set_interpolation(self, interpolation):
+        """
+        choose how the iterative, full, nested and remap methods sample the source,
+        the mip method always blends bilinear samples of its pyramid
+        """
+        if interpolation not in RecursionEngine.INTERPOLATIONS:
+            raise ValueError("Invalid interpolation: %s" % interpolation)
+        self.interpolation = interpolation
+        self._frame = None
+
+    @property
+    def sampling(self):
+        """ the cv2 interpolation flag and sample reach of the interpolation in use """
+        return RecursionEngine.INTERPOLATIONS[self.interpolation]
+
+    def clone(self):
+        """
+        returns an engine sharing this one's image, mask, hashes and caches, but
+        none of the state render_dirty keeps, so the editor can change a clone
+        while a render is still running on the original
+        """
+        engine = copy.copy(self)
+        engine._device = dict(self._device)
+        engine._frame, engine._window = None, None
+        return engine
+
+    def with_mask(self, mask=None, key=None, flags=None, rect=None):
+        """
+        returns a clone of this engine with another mask, see set_mask
+
+        if the new mask only differs from this one inside rect (x,y,w,h), a mask
+        already uploaded for the opencl backend is copied on the device and only
+        that rect is uploaded again
+        """
+        engine = self.clone()
+        engine.set_mask(mask, key, flags)
+        uploaded = self._device.get("mask")
+        if rect is not None and uploaded is not None and self.masked and engine.masked \
+                and engine.soft == self.soft:
+            patched = cv2.copyTo(uploaded, cv2.UMat())
+            if rect[2] > 0 and rect[3] > 0:
+                cv2.copyTo(cv2.UMat(engine.host("mask", rect)), cv2.UMat(),
+                           RecursionEngine.roi(patched, rect))
+            engine._device["mask"] = patched
+        return engine
+
+    def with_backend(self, backend):
+        """
+        returns a clone of this engine with another backend, see set_backend
+        """
+        engine = self.clone()
+        engine.set_backend(backend)
+        return engine
+
+    def device(self, name):
+        """
+        returns the image or mask ("image" or "mask") as a cv2.UMat, uploaded once
+        """
+        if name not in self._device:
+            self._device[name] = cv2.UMat(self.host(name))
+        return self._device[name]
+
+    def host(self, name, rect=None):
+        """
+        returns the image or mask, or just its rect (x,y,w,h), laid out as device
+        uploads it, soft masks of colour images have a channel per image channel
+        since apply_mask cannot see the channels of a cv2.UMat
+        """
+        array = self.image if name == "image" else self.mask
+        if rect is not None:
+            array = RecursionEngine.roi(array, rect)
+        if name == "mask" and self.soft and self.image.ndim == 3:
+            array = cv2.merge([array]*self.image.shape[2])
+        return np.ascontiguousarray(array)
+
+    def homography(self, dst, corner="sharp"):
+        """
+        returns the homography mapping the full image frame onto the quad dst
+
+        curved windows can bulge past dst, where the nested copy would leave a
+        gap, so for those the frame is mapped onto the quad enclosing the outline
+        """
+        r,c = self.imheight, self.imwidth
+        src = np.array([(0,0),(c,0),(c,r),(0,r)], dtype=np.float64)
+        with self.span("homography"):
+            if corner != "sharp":
+                dst = RecursionEngine.enclosing_quad(dst, self.window_outline(dst, corner))
+            hom, _ = cv2.findHomography(src, np.array(dst, dtype=np.float64))
+        return hom
+
+    def adaptive_depth(self, hom, min_area=1.0, max_depth=MAX_DEPTH):
+        """
+        returns the number of nested quads H^k(frame) whose area is at least
+        min_area pixels, stopping at max_depth if the quads never shrink enough
+        """
+        r,c = self.imheight, self.imwidth
+        quad = np.array([[(0,0),(c,0),(c,r),(0,r)]], dtype=np.float64)
+        for k in range(1, max_depth+1):
+            quad = cv2.perspectiveTransform(quad, hom)
+            if RecursionEngine.quad_area(quad[0]) < min_area:
+                return k-1
+        return max_depth
+
+    def render(self, dst, depth=4, method="iterative", min_area=1.0, corner="sharp", umat=False):
+        """
+        actually perform the recursive operation that makes in image look
+        like an infinite mirror, returns the rendered image
+
+        depth is either a number of levels or "auto", which recurses until the
+        nested window covers less than min_area pixels
+
+        the homography always maps the frame onto the 4 points of dst, but the
+        window the nested copies are blended through is the closed outline of dst
+        using the corner interpolation of Polygon.render
+
+        available render methods:
+            iterative:  warps each level inside the bounding box of the window
+                        and blends it in place through the window's alpha mask
+            full:       warps and composites the whole frame once per level
+            nested:     warps each level only inside the bounding box of its quad
+            remap:      maps every output pixel straight to its source pixel
+                        through H^k and samples the image once
+            mip:        like remap, but samples a pyramid of the source at the
+                        level matching each pixel's footprint, so deep levels
+                        are anti-aliased instead of point sampled
+
+        with the opencl backend the iterative and full methods never leave the
+        device, umat=True returns their frame as a cv2.UMat instead of downloading
+        it, and the cache is bypassed since cached frames live in host memory
+        """
+        if depth == "auto":
+            depth = self.adaptive_depth(self.homography(dst, corner), min_area)
+        if method not in RecursionEngine.METHODS:
+            raise ValueError("Invalid render method: %s" % method)
+        render = getattr(self, "render_" + method)
+        with self.span("render"):
+            if self.backend == "opencl" and method in RecursionEngine.UMAT_METHODS:
+                draw = render(dst, depth, corner)
+                return draw if umat else draw.get()
+            if self.cache is None:
+                return render(dst, depth, corner)
+
+            key = self.cache_key(dst, method, corner) + ("frame", depth)
+            draw = self.cache.get(key)
+            if draw is None:
+                draw = render(dst, depth, corner)
+                self.cache.put(key, draw)
+            return draw
+
+    METHODS = ("iterative", "full", "nested", "remap", "mip")
+    UMAT_METHODS = ("iterative", "full")
+
+    DIRTY_METHODS = ("iterative", "full", "nested", "remap")
+    def render_dirty(self, dst, depth=4, method="iterative", min_area=1.0, corner="sharp"):
+        """
+        renders dst into a frame the engine keeps between calls, re-rendering only
+        the region that can differ from the previous call, returns (patch, rect)
+        where patch is a copy of the rect (x,y,w,h) of the new frame
+
+        every level leaves the pixels outside the window as they were, and every
+        nested window H^k(window) of the old and new homographies lies inside its
+        window, so the region that changes across all levels is the bounding box of
+        the old and new windows, resetting it to the image puts the whole frame
+        back at level 0, and the method recurses from there in place
+
+        the first call returns the whole frame, as do the mip method and the opencl
+        backend, which always render from scratch, and the frame cache is only read
+        """
+        if depth == "auto":
+            depth = self.adaptive_depth(self.homography(dst, corner), min_area)
+        r,c = self.imheight, self.imwidth
+        if method not in RecursionEngine.DIRTY_METHODS or self.backend != "numpy":
+            self._frame = None
+            return self.render(dst, depth, method, min_area, corner, umat=True), (0,0,c,r)
+
+        window = RecursionEngine.bounding_rect(self.window_outline(dst, corner), (c,r))
+        if self._frame is None:
+            self._frame, self._window = self.image.copy(), window
+            rect = (0,0,c,r)
+        else:
+            rect = MaskLayer.union(self._window, window)
+        x,y,w,h = rect
+        frame = self._frame
+        with self.span("render"):
+            try:
+                frame[y:y+h, x:x+w] = self.image[y:y+h, x:x+w]
+                cached = None
+                if self.cache is not None:
+                    cached = self.cache.get(self.cache_key(dst, method, corner) + ("frame", depth))
+                if cached is not None:
+                    frame[y:y+h, x:x+w] = cached[y:y+h, x:x+w]
+                elif method == "remap":
+                    if window[2] > 0 and window[3] > 0:
+                        # rasterized like render_remap, so patches match whole renders
+                        with self.span("remap_tables"):
+                            mapx, mapy, _ = self.level_tables(dst, depth, None, corner, window, exact=False)
+                        wx,wy,ww,wh = window
+                        frame[wy:wy+wh, wx:wx+ww] = self.remap(mapx, mapy)
+                else:
+                    getattr(self, "render_" + method)(dst, depth, corner, draw=frame)
+            except Exception:
+                self._frame = None
+                raise
+        self._window = window
+        return frame[y:y+h, x:x+w].copy(), rect
+
+    def span(self, name):
+        """ returns a timing span of the profiler, which does nothing without one """
+        return self.profiler.span(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def cache_key(self, dst, method, corner="sharp"):
+        """
+        returns the cache key of the render of the quad dst, which is
+        quantized to QUANTUM pixels, and the interpolation it was sampled with
+        """
+        quad = np.round(np.array(dst, dtype=np.float64)/RecursionEngine.QUANTUM)
+        return (self.image_key, self.mask_key, tuple(quad.astype(np.int64).ravel()), method, corner,
+                self.interpolation)
+
+    def window_outline(self, dst, corner="sharp"):
+        """
+        returns the closed outline of the window dst as an (n,2) array
+        """
+        return ShapeRaster.outline(np.array(dst, dtype=np.float64), corner)
+
+    def working_copy(self, draw=None):
+        """
+        returns a copy of the image to render into, copied on the device
+        as a cv2.UMat with the opencl backend, or draw itself if given
+        """
+        if draw is not None:
+            return draw
+        if self.backend == "opencl":
+            return cv2.copyTo(self.device("image"), cv2.UMat())
+        return self.image.copy()
+
+    def resume_level(self, key, depth, draw, rect):
+        """
+        pastes the deepest cached level <= depth into the rect (x,y,w,h) of draw,
+        returns that level, or 0 if none is cached
+        """
+        if self.cache is None or isinstance(draw, cv2.UMat):
+            return 0
+        x,y,w,h = rect
+        for k in range(depth, 0, -1):
+            if key + ("level", k) in self.cache:
+                patch = self.cache.get(key + ("level", k))
+                if patch is not None:
+                    draw[y:y+h, x:x+w] = patch
+                    return k
+        return 0
+
+    def store_level(self, key, k, draw, rect):
+        """
+        caches the rect (x,y,w,h) of draw after level k, the rest of the frame
+        is untouched by the recursion
+        """
+        if self.cache is not None and not isinstance(draw, cv2.UMat):
+            x,y,w,h = rect
+            self.cache.put(key + ("level", k), draw[y:y+h, x:x+w].copy())
+
+    def render_iterative(self, dst, depth=4, corner="sharp", draw=None):
+        """
+        applies the warp and composite once per level, but only the pixels
+        inside the window survive, so the homography is translated into
+        the window's bounding box and only that sub-image is warped
+        """
+        r,c = self.imheight, self.imwidth
+        hom = self.homography(dst, corner)
+        outline = self.window_outline(dst, corner)
+        x,y,w,h = RecursionEngine.bounding_rect(outline, (c,r))
+        if w <= 0 or h <= 0:
+            return self.working_copy(draw)
+        with self.span("raster"):
+            weights = self.raster.weights(outline, (x,y,w,h))
+
+        if self.backend == "opencl":
+            weights = tuple(cv2.UMat(weight) for weight in weights)
+        draw = self.working_copy(draw)
+        key = self.cache_key(dst, "iterative", corner) if self.cache is not None else None
+        for i in range(self.resume_level(key, depth, draw, (x,y,w,h)), depth):
+            warp = self.warp_rect(draw, hom, (x,y,w,h))
+            with self.span("composite"):
+                RecursionEngine.composite(warp, weights, draw, (x,y,w,h))
+            self.store_level(key, i+1, draw, (x,y,w,h))
+        return draw
+
+    def render_full(self, dst, depth=4, corner="sharp", draw=None):
+        """
+        applies the warp and composite once per level on the full frame
+        """
+        r,c = self.imheight, self.imwidth
+        hom = self.homography(dst, corner)
+        outline = np.int32(np.round(self.window_outline(dst, corner)))
+
+        window = cv2.fillPoly(np.zeros((r,c), dtype=np.uint8), [outline], 255)
+        mask = self._mask if self.masked else None
+        if self.backend == "opencl":
+            window = cv2.UMat(window)
+            mask = self.device("mask") if self.masked else None
+
+        draw = self.working_copy(draw)
+        for i in range(depth):
+            with self.span("mask"):
+                masked = RecursionEngine.apply_mask(draw, mask, self.soft)
+            with self.span("warp"):
+                warp = cv2.warpPerspective(masked, hom, (c,r), flags=self.sampling[0])
+            with self.span("composite"):
+                cv2.copyTo(warp, window, draw)
+        return draw
+
+    def render_nested(self, dst, depth=4, corner="sharp", draw=None):
+        """
+        level k only changes the pixels inside the nested window H^(k-1)(window),
+        so each level is warped and composited inside that window's bounding box
+        """
+        r,c = self.imheight, self.imwidth
+        hom = self.homography(dst, corner)
+        outline = self.window_outline(dst, corner)
+        wx,wy,ww,wh = RecursionEngine.bounding_rect(outline, (c,r))
+        if ww <= 0 or wh <= 0:
+            return self.working_copy(draw)
+        with self.span("raster"):
+            alpha, inv = self.raster.weights(outline, (wx,wy,ww,wh))
+
+        draw = self.working_copy(draw)
+        key = self.cache_key(dst, "nested", corner) if self.cache is not None else None
+        start = self.resume_level(key, depth, draw, (wx,wy,ww,wh))
+        powers = RecursionEngine.homography_powers(hom, depth)
+        for k in range(start+1, depth+1):
+            nested = cv2.perspectiveTransform(outline[None], powers[k-1])[0]
+            x,y,w,h = RecursionEngine.bounding_rect(nested, (c,r))
+            # blending outside the window's own box would be a no-op
+            x0, y0 = max(x, wx), max(y, wy)
+            x1, y1 = min(x+w, wx+ww), min(y+h, wy+wh)
+            if x1 <= x0 or y1 <= y0:
+                break
+            rect = (x0, y0, x1-x0, y1-y0)
+            sub = (slice(y0-wy, y1-wy), slice(x0-wx, x1-wx))
+            warp = self.warp_rect(draw, hom, rect)
+            with self.span("composite"):
+                RecursionEngine.composite(warp, (alpha[sub], inv[sub]), draw, rect)
+            self.store_level(key, k, draw, (wx,wy,ww,wh))
+        return draw
+
+    def warp_rect(self, draw, hom, rect):
+        """
+        returns the masked draw warped through hom, computed only inside rect = (x,y,w,h)
+        only the part of draw that maps into rect is masked and sampled
+        """
+        r,c = self.imheight, self.imwidth
+        x,y,w,h = rect
+        corners = np.array([[(x,y),(x+w,y),(x+w,y+h),(x,y+h)]], dtype=np.float64)
+        src = cv2.perspectiveTransform(corners, np.linalg.inv(hom))[0]
+        flag, reach = self.sampling
+        sx,sy,sw,sh = RecursionEngine.bounding_rect(src, (c,r), pad=reach+1)
+        if sw <= 0 or sh <= 0:
+            return np.zeros((h,w) + self.image.shape[2:], dtype=self.image.dtype)
+
+        mask = None
+        if self.masked:
+            mask = self.device("mask") if isinstance(draw, cv2.UMat) else self._mask
+        with self.span("mask"):
+            masked = RecursionEngine.apply_mask(RecursionEngine.roi(draw, (sx,sy,sw,sh)),
+                                                RecursionEngine.roi(mask, (sx,sy,sw,sh)), self.soft)
+        shifted = RecursionEngine.translation(-x, -y) @ hom @ RecursionEngine.translation(sx, sy)
+        with self.span("warp"):
+            return cv2.warpPerspective(masked, shifted, (w,h), flags=flag)
+
+    def render_remap(self, dst, depth=4, corner="sharp"):
+        """
+        composites all recursion levels with a single remap of the source image
+
+        the nested quads Q_k = H^k(frame) are nested inside each other, so an output
+        pixel p lies at level L, the deepest k <= depth with p in Q_k, and its
+        colour is image(H^-L p), or black if the mask is empty at any H^-j p, j <= L
+
+        outside the window's bounding box every pixel is at level 0, so only
+        that box is remapped and the rest is copied from the image
+        """
+        r,c = self.imheight, self.imwidth
+        x,y,w,h = RecursionEngine.bounding_rect(self.window_outline(dst, corner), (c,r))
+        draw = self.image.copy()
+        if w > 0 and h > 0:
+            with self.span("remap_tables"):
+                mapx, mapy, _ = self.level_tables(dst, depth, None, corner, (x,y,w,h), exact=False)
+            draw[y:y+h, x:x+w] = self.remap(mapx, mapy)
+        return draw
+
+    def render_mip(self, dst, depth=4, corner="sharp"):
+        """
+        samples every pixel of level k >= 1 straight from a pyramid of the source
+
+        the footprint of an output pixel p in the source is |det J| of H^-k at p,
+        which for a homography G is |det G| / w(p)^3, the pyramid level is log2 of
+        the footprint's side, and the two nearest levels are blended (trilinear)
+        """
+        with self.span("remap_tables"):
+            mapx, mapy, level = self.level_tables(dst, depth, corner=corner)
+        mipmaps = self.mip_pyramid()
+        hom = self.homography(dst, corner)
+        powers = RecursionEngine.homography_powers(np.linalg.inv(hom), depth)
+
+        draw = self.image.copy()
+        draw[level < 0] = 0
+        with self.span("mip"):
+            for k in range(1, depth+1):
+                sel = np.flatnonzero(level == k)
+                if not len(sel):
+                    continue
+                ys, xs = np.divmod(sel, self.imwidth)
+                G = powers[k]
+                w = G[2,0]*xs + G[2,1]*ys + G[2,2]
+                lod = 0.5*np.log2(np.maximum(abs(np.linalg.det(G))/np.abs(w)**3, 1e-12))
+                lod = np.clip(lod, 0, len(mipmaps)-1).astype(np.float32)
+                x, y = mapx.ravel()[sel], mapy.ravel()[sel]
+                # blend level lo with lo+1, the last level is only ever blended into
+                lo = np.minimum(lod.astype(np.intp), max(len(mipmaps)-2, 0))
+                color = np.empty((len(sel),) + draw.shape[2:], dtype=np.float32)
+                for m in np.unique(lo):
+                    grp = np.flatnonzero(lo == m)
+                    gx, gy = x[grp], y[grp]
+                    a = self.mip_sample(m, gx, gy)
+                    if m+1 < len(mipmaps):
+                        t = (lod[grp] - m).reshape((-1,) + (1,)*(draw.ndim-2))
+                        b = self.mip_sample(m+1, gx, gy)
+                        a += t*(b - a)
+                    color[grp] = a
+                draw.reshape((-1,) + draw.shape[2:])[sel] = np.clip(color + 0.5, 0, 255).astype(draw.dtype)
+        return draw
+
+    MIN_MIPMAP_SIZE = 2
+    def mip_pyramid(self):
+        """
+        returns the source image pyramid, level m is the source area averaged
+        down by 2 m times, so each pixel covers the source pixels it averages
+        rather than being centred on one of them as with pyrDown
+
+        levels are float32, so neither the averages nor the samples taken from
+        them are rounded to the image's integer type before they are blended
+        """
+        if self.mipmaps is None:
+            with self.span("mip_pyramid"):
+                self.mipmaps = [self.image.astype(np.float32)]
+                while min(self.mipmaps[-1].shape[:2]) >= 2*RecursionEngine.MIN_MIPMAP_SIZE:
+                    h,w = self.mipmaps[-1].shape[:2]
+                    self.mipmaps.append(cv2.resize(self.mipmaps[-1], ((w+1)//2, (h+1)//2),
+                                                   interpolation=cv2.INTER_AREA))
+        return self.mipmaps
+
+    def mip_sample(self, m, x, y):
+        """
+        returns level m of the mip pyramid bilinearly sampled at the source points
+        (x,y), a level w pixels across puts source point x at (x+0.5)*w/c - 0.5,
+        which is (x+0.5)/2^m - 0.5 when c is a multiple of 2^m
+        """
+        mip = self.mip_pyramid()[m]
+        h,w = mip.shape[:2]
+        return RecursionEngine.remap_points(mip, (x+0.5)*(w/self.imwidth) - 0.5,
+                                            (y+0.5)*(h/self.imheight) - 0.5)
+
+    def remap(self, mapx, mapy):
+        """
+        samples the image through remap tables from remap_tables,
+        which may also have been converted to fixed point by cv2.convertMaps
+        """
+        with self.span("remap"):
+            return cv2.remap(self.image, mapx, mapy, self.sampling[0],
+                             borderMode=cv2.BORDER_CONSTANT, borderValue=(0,0,0))
+
+    def remap_tables(self, dst, depth=4, view=None, corner="sharp", rect=None):
+        """
+        returns the (mapx, mapy) tables taking each output pixel straight to its
+        source pixel, these only depend on the quad, mask and depth so they can be
+        reused for any image of the same size
+
+        if view is given, output pixel p shows the mirror image at view(p), so
+        any view of the infinite mirror is sampled straight from the source
+
+        if rect = (x,y,w,h) is given, the tables only cover that part of the output
+        """
+        with self.span("remap_tables"):
+            mapx, mapy, _ = self.level_tables(dst, depth, view, corner, rect)
+        return mapx, mapy
+
+    def level_tables(self, dst, depth=4, view=None, corner="sharp", rect=None, exact=None):
+        """
+        returns the remap tables along with the recursion level of each output
+        pixel, which is -1 where the mask hides the pixel
+
+        exact tests curved windows against the outline itself rather than its
+        raster, which renders slightly differently along the edge, it defaults
+        to whether a rect is given
+
+        without a view only pixels inside the window's bounding box can reach
+        level 1, the rest are level 0 and map to themselves, so the levels are
+        only searched for inside that box
+        """
+        r,c = self.imheight, self.imwidth
+        if exact is None:
+            exact = rect is not None
+        rx,ry,rw,rh = rect if rect is not None else (0,0,c,r)
+        x0,y0,w,h = rx,ry,rw,rh
+        if view is None:
+            bx,by,bw,bh = RecursionEngine.bounding_rect(self.window_outline(dst, corner), (c,r))
+            x0, y0 = max(rx, bx), max(ry, by)
+            w, h = max(min(rx+rw, bx+bw) - x0, 0), max(min(ry+rh, by+bh) - y0, 0)
+            if (x0,y0,w,h) != (rx,ry,rw,rh):
+                tablex = np.empty((rh,rw), dtype=np.float32)
+                tabley = np.empty((rh,rw), dtype=np.float32)
+                tablex[:] = np.arange(rx, rx+rw, dtype=np.float32)
+                tabley[:] = np.arange(ry, ry+rh, dtype=np.float32)[:,None]
+                levels = np.zeros((rh,rw), dtype=np.int32)
+                if w > 0 and h > 0:
+                    sub = (slice(y0-ry, y0-ry+h), slice(x0-rx, x0-rx+w))
+                    tablex[sub], tabley[sub], levels[sub] = self.level_tables(
+                        dst, depth, None, corner, (x0,y0,w,h), exact)
+                return tablex, tabley, levels
+        hom = self.homography(dst, corner)
+        powers = RecursionEngine.homography_powers(np.linalg.inv(hom), depth)
+        quads = RecursionEngine.nested_quads(hom, (c,r), depth)
+        mask, masked = self._mask, self.masked
+        if corner != "sharp" and exact:
+            # rasterizing the whole window of a huge image would defeat the tiling
+            outline = self.window_outline(dst, corner)
+            def inside(k, x, y):
+                return RecursionEngine.inside_outline(outline, *RecursionEngine.project(powers[k-1], x, y))
+        elif corner != "sharp":
+            # p is in the nested window k if H^-(k-1) p is inside the rasterized window
+            outline = self.window_outline(dst, corner)
+            wx,wy,ww,wh = RecursionEngine.bounding_rect(outline, (c,r))
+            window = self.raster.coverage(outline, (wx,wy,ww,wh))
+            def inside(k, x, y):
+                x, y = RecursionEngine.project(powers[k-1], x, y)
+                xi, yi = np.round(x).astype(np.intp)-wx, np.round(y).astype(np.intp)-wy
+                ok = (xi >= 0) & (xi < ww) & (yi >= 0) & (yi < wh)
+                ok[ok] = window[yi[ok], xi[ok]] >= 128
+                return ok
+        else:
+            inside = lambda k, x, y: RecursionEngine.inside_quad(quads[k], x, y)
+
+        # find the level of each pixel, only testing pixels still inside the previous quad
+        ys, xs = np.mgrid[y0:y0+h, x0:x0+w]
+        if view is not None:
+            xs, ys = RecursionEngine.project(view, xs, ys)
+        mapx, mapy = xs.astype(np.float32), ys.astype(np.float32)
+        level = np.zeros((h,w), dtype=np.int32)
+        if corner == "sharp" and view is None:
+            # on the pixel grid each quad is tested by rows and columns, inside its bounding box
+            gx, gy = np.arange(x0, x0+w), np.arange(y0, y0+h)
+            inside = np.ones((h,w), dtype=bool)
+            for k in range(1, depth+1):
+                (qx0,qy0), (qx1,qy1) = quads[k].min(axis=0), quads[k].max(axis=0)
+                cols = np.flatnonzero((gx >= qx0) & (gx <= qx1))
+                rows = np.flatnonzero((gy >= qy0) & (gy <= qy1))
+                if not len(cols) or not len(rows):
+                    break
+                sub = (slice(rows[0], rows[-1]+1), slice(cols[0], cols[-1]+1))
+                nested = np.zeros((h,w), dtype=bool)
+                nested[sub] = inside[sub] & RecursionEngine.inside_quad_grid(quads[k], gx[sub[1]], gy[sub[0]])
+                level[sub] += nested[sub]
+                inside = nested
+        else:
+            idx = np.arange(w*h)
+            for k in range(1, depth+1):
+                x, y = xs.ravel()[idx], ys.ravel()[idx]
+                idx = idx[inside(k, x, y)]
+                if not len(idx):
+                    break
+                level.ravel()[idx] = k
+
+        # map every pixel of level L through H^-L, and drop pixels the mask hides
+        keep = np.ones(w*h, dtype=bool)
+        for k in range(1, depth+1):
+            sel = np.flatnonzero(level >= k) if masked else np.flatnonzero(level == k)
+            if not len(sel):
+                break
+            x, y = RecursionEngine.project(powers[k], xs.ravel()[sel], ys.ravel()[sel])
+            if masked:
+                xi = np.clip(np.round(x).astype(np.intp), 0, c-1)
+                yi = np.clip(np.round(y).astype(np.intp), 0, r-1)
+                keep[sel] &= mask[yi, xi] != 0
+                final = level.ravel()[sel] == k
+                sel, x, y = sel[final], x[final], y[final]
+            mapx.ravel()[sel] = x
+            mapy.ravel()[sel] = y
+
+        # out of frame coordinates sample the black border
+        mapx.ravel()[~keep] = -16
+        mapy.ravel()[~keep] = -16
+        level.ravel()[~keep] = -1
+        return mapx, mapy, level
+
+    REMAP_LIMIT = 32767     # cv2.remap only takes sources smaller than SHRT_MAX
+    def render_tile(self, dst, depth, rect, corner="sharp"):
+        """
+        renders only the rect (x,y,w,h) of the output, like render_remap
+
+        the pixels of each level are sampled from just the part of the source
+        they map into, so on a memory-mapped image only those pages are read,
+        levels deep enough to cover more than REMAP_LIMIT source pixels are
+        minified so far that nearest sampling is used instead
+        """
+        r,c = self.imheight, self.imwidth
+        x,y,w,h = rect
+        mapx, mapy, level = self.level_tables(dst, depth, corner=corner, rect=rect)
+        flag, reach = self.sampling
+        tile = np.zeros((h,w) + self.image.shape[2:], dtype=self.image.dtype)
+        for k in np.unique(level[level >= 0]):
+            sel = level == k
+            sx, sy = mapx[sel], mapy[sel]
+            x0, y0 = max(int(np.floor(sx.min()))-reach, 0), max(int(np.floor(sy.min()))-reach, 0)
+            x1, y1 = min(int(np.ceil(sx.max()))+reach+1, c), min(int(np.ceil(sy.max()))+reach+1, r)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            if max(x1-x0, y1-y0) < RecursionEngine.REMAP_LIMIT:
+                sampled = cv2.remap(self.image[y0:y1, x0:x1], mapx-x0, mapy-y0, flag,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=(0,0,0))
+                tile[sel] = sampled[sel]
+            else:
+                xi = np.clip(np.round(sx).astype(np.intp), 0, c-1)
+                yi = np.clip(np.round(sy).astype(np.intp), 0, r-1)
+                tile[sel] = self.image[yi, xi]
+        return tile
+
+    @staticmethod
+    def homography_powers(hom, depth):
+        """ returns [H^0, H^1, ..., H^depth] """
+        powers = [np.eye(3)]
+        for k in range(depth):
+            powers.append(powers[-1] @ hom)
+        return powers
+
+    @staticmethod
+    def fractional_power(hom, t):
+        """
+        returns H^t for real t through the eigendecomposition of H, which is
+        normalized to unit determinant first since homographies are only defined up
+        to scale, raises ValueError if H^t has no real value (e.g. mirrored quads)
+        """
+        det = np.linalg.det(hom)
+        if det <= 0:
+            raise ValueError("Homography reverses orientation, H^t is not real")
+        vals, vecs = np.linalg.eig(hom/np.cbrt(det))
+        power = (vecs @ np.diag(vals.astype(complex)**t) @ np.linalg.inv(vecs))
+        if np.abs(power.imag).max() > 1e-6*np.abs(power.real).max():
+            raise ValueError("Homography has no real power %g" % t)
+        return power.real
+
+    @staticmethod
+    def nested_quads(hom, size, depth):
+        """ returns the corners of the frame of the given size under H^0 ... H^depth """
+        c,r = size
+        corners = np.array([[(0,0),(c,0),(c,r),(0,r)]], dtype=np.float64)
+        return [cv2.perspectiveTransform(corners, power)[0]
+                for power in RecursionEngine.homography_powers(hom, depth)]
+
+    MASK_CHUNK = 1 << 20    # pixels mask_flags scans at a time
+    @staticmethod
+    def mask_flags(mask):
+        """
+        returns (masked, soft), whether the single channel mask hides anything and
+        whether any pixel is only partially covered, scanning MASK_CHUNK pixels at
+        a time so a memory-mapped mask is never expanded whole, and stopping at
+        the first partial pixel
+        """
+        rows = max(RecursionEngine.MASK_CHUNK // max(mask.shape[1], 1), 1)
+        masked = False
+        for y in range(0, mask.shape[0], rows):
+            hidden = mask[y:y+rows] != 255
+            if not hidden.any():
+                continue
+            masked = True
+            if np.any(hidden & (mask[y:y+rows] != 0)):
+                return True, True
+        return masked, False
+
+    @staticmethod
+    def enclosing_quad(quad, outline):
+        """
+        returns quad with each edge moved out along its normal until the outline
+        lies inside it, or quad itself if it is not convex
+        """
+        quad = np.asarray(quad, dtype=np.float64)
+        edges = np.roll(quad, -1, axis=0) - quad
+        turns = edges[:,0]*np.roll(edges[:,1], -1) - edges[:,1]*np.roll(edges[:,0], -1)
+        if not (np.all(turns > 0) or np.all(turns < 0)):
+            return quad
+        # outward unit normals, and the offset of each edge's line n.p = d
+        normals = np.sign(turns[0]) * np.stack([edges[:,1], -edges[:,0]], axis=1)
+        normals /= np.linalg.norm(normals, axis=1)[:,None]
+        d = np.einsum("ij,ij->i", normals, quad)
+        d = np.maximum(d, (np.asarray(outline, dtype=np.float64) @ normals.T).max(axis=0))
+        # corner i is where the lines of edges i-1 and i meet
+        return np.array([np.linalg.solve(normals[[i-1, i]], d[[i-1, i]]) for i in range(4)])
+
+    @staticmethod
+    def quad_area(quad):
+        """ returns the area of the polygon quad using the shoelace formula """
+        x, y = quad[:,0], quad[:,1]
+        return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))/2
+
+    @staticmethod
+    def bounding_rect(pts, size, pad=1):
+        """ returns the (x,y,w,h) box around pts grown by pad and clipped to the frame size """
+        c,r = size
+        x0 = max(int(np.floor(pts[:,0].min()))-pad, 0)
+        y0 = max(int(np.floor(pts[:,1].min()))-pad, 0)
+        x1 = min(int(np.ceil(pts[:,0].max()))+pad, c)
+        y1 = min(int(np.ceil(pts[:,1].max()))+pad, r)
+        return x0, y0, x1-x0, y1-y0
+
+    @staticmethod
+    def composite(warp, weights, draw, rect):
+        """ blends warp into the rect (x,y,w,h) of draw in place using the (alpha, 1-alpha) weights """
+        region = RecursionEngine.roi(draw, rect)
+        if isinstance(draw, cv2.UMat):
+            cv2.blendLinear(warp, region, *weights, dst=region)
+        else:
+            region[...] = cv2.blendLinear(warp, region, *weights)
+
+    @staticmethod
+    def roi(img, rect):
+        """
+        returns the rect (x,y,w,h) of the np img or cv2.UMat img as a view, or None if img is None
+        """
+        if img is None:
+            return None
+        x,y,w,h = rect
+        if isinstance(img, cv2.UMat):
+            return cv2.UMat(img, (y,y+h), (x,x+w))
+        return img[y:y+h, x:x+w]
+
+    @staticmethod
+    def opencl_available():
+        """
+        returns whether opencv can run cv2.UMat operations on an OpenCL device
+        """
+        if not cv2.ocl.haveOpenCL():
+            return False
+        cv2.ocl.setUseOpenCL(True)
+        return cv2.ocl.useOpenCL()
+
+    @staticmethod
+    def apply_mask(img, alpha, soft=True):
+        """
+        returns img scaled by the single channel alpha/255, or img itself if alpha is None,
+        hard masks (only 0 or 255) are copied through rather than multiplied
+        a cv2.UMat img needs a soft alpha with as many channels as it has
+        """
+        if alpha is None:
+            return img
+        if not soft:
+            return cv2.copyTo(img, alpha)
+        if isinstance(img, np.ndarray) and img.ndim == 3:
+            alpha = cv2.merge([alpha]*img.shape[2])
+        return cv2.multiply(img, alpha, scale=1/255)
+
+    REMAP_ROW = 1024
+    @staticmethod
+    def remap_points(img, x, y):
+        """
+        returns img bilinearly sampled at the points (x,y) as float32, which is
+        only unrounded if img is float32 already, points outside img fade to black
+        as they do in remap, the points are laid out in rows of REMAP_ROW since
+        cv2.remap maps are limited to SHRT_MAX
+        """
+        n, row = len(x), RecursionEngine.REMAP_ROW
+        rows = -(-n // row)
+        mapx = np.full(rows*row, -16, dtype=np.float32)
+        mapy = np.full(rows*row, -16, dtype=np.float32)
+        mapx[:n], mapy[:n] = x, y
+        sampled = cv2.remap(img, mapx.reshape(rows, row), mapy.reshape(rows, row), cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_CONSTANT, borderValue=(0,0,0))
+        return sampled.reshape((rows*row,) + img.shape[2:])[:n].astype(np.float32)
+
+    @staticmethod
+    def translation(dx, dy):
+        """ returns the homography translating by (dx,dy) """
+        return np.array([[1,0,dx],[0,1,dy],[0,0,1]], dtype=np.float64)
+
+    @staticmethod
+    def project(hom, x, y):
+        """ applies the homography hom to the points (x,y) """
+        w = hom[2,0]*x + hom[2,1]*y + hom[2,2]
+        return (hom[0,0]*x + hom[0,1]*y + hom[0,2])/w, (hom[1,0]*x + hom[1,1]*y + hom[1,2])/w
+
+    @staticmethod
+    def inside_outline(outline, x, y):
+        """ returns whether each point (x,y) lies inside the closed outline, by the even-odd rule """
+        inside = np.zeros(len(x), dtype=bool)
+        for (ax,ay), (bx,by) in zip(outline, np.roll(outline, -1, axis=0)):
+            if ay == by:
+                continue
+            cross = (ay > y) != (by > y)
+            cross[cross] = x[cross] < ax + (y[cross]-ay)*(bx-ax)/(by-ay)
+            inside ^= cross
+        return inside
+
+    @staticmethod
+    def inside_quad_grid(quad, xs, ys):
+        """
+        returns inside_quad of every point of the grid of columns xs and rows ys
+        as a (len(ys), len(xs)) array, each edge test splits into a term per row
+        and one per column, computed as inside_quad computes them, so they agree
+        """
+        (x0,y0), (x1,y1) = quad.min(axis=0), quad.max(axis=0)
+        inside = ((ys >= y0) & (ys <= y1))[:,None] & ((xs >= x0) & (xs <= x1))[None]
+        pos, neg = inside.copy(), inside
+        for (ax,ay), (bx,by) in zip(quad, np.roll(quad, -1, axis=0)):
+            row, col = ((bx-ax)*(ys-ay))[:,None], ((by-ay)*(xs-ax))[None]
+            pos &= row >= col
+            neg &= row <= col
+        return pos | neg
+
+    @staticmethod
+    def inside_quad(quad, x, y):
+        """ returns whether each point (x,y) lies inside the convex quad """
+        # only points inside the quad's bounding box need the edge tests
+        (x0,y0), (x1,y1) = quad.min(axis=0), quad.max(axis=0)
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        box = np.flatnonzero(inside)
+        x, y = x[box], y[box]
+        pos, neg = np.ones(len(x), dtype=bool), np.ones(len(x), dtype=bool)
+        for (ax,ay), (bx,by) in zip(quad, np.roll(quad, -1, axis=0)):
+            cross = (bx-ax)*(y-ay) - (by-ay)*(x-ax)
+            pos &= cross >= 0
+            neg &= cross <= 0
+        inside[box] = pos | neg
+        return inside
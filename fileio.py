@@ -0,0 +1,168 @@
+import os
+import cv2
+import queue
+import threading
+from PIL import Image
+
+class ImageIO:
+    """
+    The ImageIO class decodes and encodes images on a background thread so the
+    editor never blocks on a large file
+
+    jobs run in the order they were submitted and report back through the results
+    queue as (kind, path, result), where kind is one of:
+        preview:    a reduced decode of a jpeg, sent before the full decode
+        image:      the full decode, or None if the file could not be read
+        saved:      the path was written, result is None or the error
+    """
+
+    DEFAULT_OPTIONS = {
+        "jpeg_quality": 95,         # 0-100
+        "jpeg_progressive": False,
+        "png_compression": 3,       # 0-9, higher is smaller and slower
+        "webp_quality": 95,         # 1-100
+        "chunk_size": 1 << 20,      # bytes written at a time
+    }
+
+    def __init__(self, options=None):
+        self.options = dict(ImageIO.DEFAULT_OPTIONS, **(options or {}))
+        self.results = queue.Queue()    # finished (kind, path, result)
+        self._jobs = queue.Queue()
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def load(self, path, preview_size=1024):
+        """
+        decode path in the background, jpegs whose smaller side is at least
+        2*preview_size also get a reduced preview decode first
+        """
+        self._submit(("load", path, preview_size))
+
+    def save(self, path, image, **options):
+        """
+        encode image to path in the background, options override self.options
+        the image must not be modified until the save is reported
+        """
+        self._submit(("save", path, (image, dict(self.options, **options))))
+
+    def idle(self):
+        """
+        returns whether no job is waiting or running
+        """
+        with self._lock:
+            return self._busy == 0
+
+    def _submit(self, job):
+        with self._lock:
+            self._busy += 1
+        self._jobs.put(job)
+
+    def _run(self):
+        while True:
+            kind, path, arg = self._jobs.get()
+            try:
+                if kind == "load":
+                    self._load(path, arg)
+                else:
+                    self._save(path, *arg)
+            except Exception as e:
+                # report the job as failed rather than let the thread die with it
+                self.results.put(("image", path, None) if kind == "load" else ("saved", path, e))
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def _load(self, path, preview_size):
+        try:
+            reduce = ImageIO.preview_reduction(path, preview_size)
+            if reduce > 1:
+                flag = getattr(cv2, "IMREAD_REDUCED_COLOR_%d" % reduce)
+                preview = cv2.imread(path, flag)
+                if preview is not None:
+                    self.results.put(("preview", path, preview))
+            image = cv2.imread(path)
+        except cv2.error:
+            image = None
+        self.results.put(("image", path, image))
+
+    def _save(self, path, image, options):
+        try:
+            ImageIO.write(path, image, options)
+            self.results.put(("saved", path, None))
+        except Exception as e:
+            self.results.put(("saved", path, e))
+
+    @staticmethod
+    def preview_reduction(path, preview_size):
+        """
+        returns the largest of 1, 2, 4 or 8 to reduce the decode of path by while
+        keeping its smaller side at least preview_size, only jpegs decode faster
+        when reduced so anything else is 1
+
+        anything PIL refuses to open is decoded in full without a preview,
+        including jpegs past its decompression bomb limit (about 179 MP)
+        """
+        try:
+            with Image.open(path) as im:
+                if im.format != "JPEG":
+                    return 1
+                side = min(im.size)
+        except Exception:
+            return 1
+        reduce = 1
+        while reduce < 8 and side//(2*reduce) >= preview_size:
+            reduce *= 2
+        return reduce
+
+    @staticmethod
+    def read_mask(path):
+        """
+        returns the mask image at path as a single channel, where a pixel is kept
+        if any of its colour channels is set, as RecursionEngine reduces 3 channel
+        masks, or None if it could not be read
+        """
+        mask = cv2.imread(path, cv2.IMREAD_COLOR)
+        return mask.max(axis=2) if mask is not None else None
+
+    @staticmethod
+    def encode_params(path, options):
+        """
+        returns the cv2.imencode params for the extension of path
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".jpg", ".jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, int(options["jpeg_quality"]),
+                    cv2.IMWRITE_JPEG_PROGRESSIVE, int(bool(options["jpeg_progressive"]))]
+        if ext == ".png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, int(options["png_compression"])]
+        if ext == ".webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, int(options["webp_quality"])]
+        return []
+
+    @staticmethod
+    def encode(ext, image, options=None):
+        """
+        returns image encoded in the format of the extension ext, e.g. ".png",
+        as a memoryview of bytes
+        """
+        options = dict(ImageIO.DEFAULT_OPTIONS, **(options or {}))
+        ok, data = cv2.imencode(ext, image, ImageIO.encode_params("image" + ext, options))
+        if not ok:
+            raise IOError("Could not encode image as %s" % ext)
+        return memoryview(data).cast("B")
+
+    @staticmethod
+    def write(path, image, options=None):
+        """
+        encode image for the extension of path and stream it to a temporary file
+        in chunks, which then replaces path, so path is never left half written
+        """
+        options = dict(ImageIO.DEFAULT_OPTIONS, **(options or {}))
+        data = ImageIO.encode(os.path.splitext(path)[1], image, options)
+        part = path + ".part"
+        with open(part, "wb") as f:
+            for start in range(0, len(data), options["chunk_size"]):
+                f.write(data[start:start+options["chunk_size"]])
+        os.replace(part, path)
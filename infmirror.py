@@ -3,7 +3,15 @@ import numpy as np
 import tkinter as tk
 import time, sys
 from polygon import Polygon
-from PIL import Image, ImageTk
+from engine import RecursionEngine
+from worker import RenderWorker
+from cache import RenderCache
+from masks import MaskLayer
+from spatial import PointIndex
+from scene import CanvasScene
+from profiler import Profiler
+from display import TkDisplay
+from fileio import ImageIO
 from tkinter import filedialog as fd
 
 class Interact(tk.Tk):
@@ -27,6 +35,7 @@ class Interact(tk.Tk):
         self.filemenu = tk.Menu(self.menu, tearoff=0)
         self.filemenu.add_command(label="Open", command=self.load)
         self.filemenu.add_command(label="Save", command=self.save)
+        self.filemenu.add_command(label="Export Trace", command=self.export_trace)
         self.filemenu.add_separator()
         self.filemenu.add_command(label="Exit", command=self.quit)
         self.menu.add_cascade(label="File", menu=self.filemenu)
@@ -42,21 +51,29 @@ class Interact(tk.Tk):
         save the current image to a file
         ignores the mask and window elements when rendering canvas
         """
-        self.canvas.after_cancel(self.canvas.redraw_timer)
-        self.update_idletasks()
         savefile = fd.asksaveasfilename()
-        cv2.imwrite(savefile, self.canvas.draw)
-        self.canvas.after(100, self.canvas.redraw)
+        if not savefile:
+            return
+        self.canvas.save_image(savefile)
+    
+    def export_trace(self):
+        """
+        save the recorded timing spans as a chrome trace event file
+        """
+        tracefile = fd.asksaveasfilename(defaultextension=".json")
+        if not tracefile:
+            return
+        n = self.canvas.profiler.export_trace(tracefile)
+        print("wrote %d trace events to %s" % (n, tracefile))
     
     def load(self):
         """
         load an image to edit from a file
         """
-        self.canvas.after_cancel(self.canvas.redraw_timer)
-        self.update_idletasks()
         imfile = fd.askopenfilename()
+        if not imfile:
+            return
         self.canvas.load_image(imfile)
-        self.canvas.after(100, self.canvas.redraw) 
     
     def on_resize(self, event):
         """
@@ -97,13 +114,34 @@ class RecursiveImageGenerator(tk.Canvas):
         # init instance vars
         self.imfile = None  # str - image file path
         self.image = None   # np img - unmodified image
-        self.draw = None    # np img - modified image
-        self.disp = None    # tk img - photoimage for tk
+        self.draw = None    # np img - modified image, a cv2.UMat from the opencl backend
+        self.display = None # TkDisplay - persistent photoimage frames are pasted into
+        self.pyramid = []   # [np img] - image downsampled by 2 at each level
+        self.engines = []   # [RecursionEngine] - one per pyramid level
+        self.frames = {}    # {int: np img} - frame of each pyramid level, patched by the render worker
+        self.patch = None   # (x,y,w,h) - part of self.draw changed since it was shown, None if nothing
+        self.level = 0      # int - pyramid level self.draw was rendered at
+        self.latency = {}   # {int: float} - last render time in seconds per level
+        self.version = 0    # int - incremented whenever a new render is requested
+        self.drawn = 0      # int - version that self.draw was rendered from
+        self.reported = 0   # int - version whose render latency was last reported
+        self.generation = 0 # int - incremented whenever the image is replaced, tags render requests
+        self.worker = RenderWorker(RecursiveImageGenerator.render_job)
+        self.cache = RenderCache()  # rendered frames shared by all pyramid levels
+        self.masks = []             # [MaskLayer] - mask composed from the mask elements per pyramid level
+        self.corner = "sharp"       # corner interpolation of the window and mask elements
+        self.method = "iterative"   # RecursionEngine render method, "mip" for quality mode
+        self.backend = "numpy"      # RecursionEngine backend, "opencl" keeps frames on the device
+        self.profiler = Profiler()  # timing spans of every render and display stage
+        self.hud = False            # whether the performance overlay is shown
+        self.io = ImageIO()         # decodes and encodes image files in the background
+        self.io_timer = None        # pending io poll callback, if any
         
         self.imwidth, self.imheight = width, height
         self.realwidth, self.realheight = width, height
-        self.dirty = True  # whether drawing needs to be updated
+        self.dirty = {"geometry"}  # stages of the drawing that need to be updated
         self.ready = False  # whether the parent is done setting up
+        self.redraw_timer = None  # pending redraw callback, if any
         
         self.mouseclick = False
         self.mousex, self.mousey = 0, 0
@@ -111,28 +149,22 @@ class RecursiveImageGenerator(tk.Canvas):
         
         # init display elements
         self.default_background()
-        self.disp = self.to_tkimg(self.draw)
-        self.create_image(0,0, anchor=tk.NW, image=self.disp, tag="img")
+        self.display = TkDisplay((width, height), self.profiler)
+        self.create_image(0,0, anchor=tk.NW, image=self.display.show(self.draw), tag="img")
         
         self.poly = Polygon([(50,40),(70,40),(70,60),(50,60)])
         self.mask_elements = []
         self.new_mask = None
-        self.redraw_polys()
         
-        self.selected = None
+        # index of every pickable point, keyed "window", ("mask", i) and "new_mask"
+        self.index = PointIndex()
+        self.index.add("window", self.poly)
+        self.selected = None    # (key, i) - point being dragged
+        self.hover = False      # whether a point is under the cursor
+        self.scene = CanvasScene(self)  # one canvas item per indexed polygon
+        self.redraw_polys()
         
-        self.after(100, self.redraw)
-    
-    def to_tkimg(self, img):
-        """
-        cv2 images are incompatible with tk
-        this method allows conversion between the image types
-        """
-        img_cv2 = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img_scl = cv2.resize(img_cv2, (int(self.realwidth), int(self.realheight)))
-        img_pil = Image.fromarray(img_scl)
-        img_tk = ImageTk.PhotoImage(image=img_pil)
-        return img_tk
+        self.redraw_timer = self.after(100, self.redraw)
     
     def default_background(self):
         """
@@ -145,71 +177,301 @@ class RecursiveImageGenerator(tk.Canvas):
                                 defaulttext, (320-width//2,240-height//2), 
                                 cv2.FONT_HERSHEY_SIMPLEX, .5, (100,100,100))
         self.draw = self.image.copy()
-        self.mask = np.full((self.imheight, self.imwidth), 255, dtype=(np.uint8, 3))
+        self.imheight, self.imwidth = self.image.shape[:2]
+        self.engine = RecursionEngine(self.image, cache=self.cache, profiler=self.profiler,
+                                      backend=self.backend)
+        self.mask = self.engine.mask
+        self.build_pyramid()
+    
+    MIN_PYRAMID_SIZE = 64
+    def build_pyramid(self):
+        """
+        build the level of detail pyramid of the image, each level is half
+        the size of the previous one, and an empty mask layer per level
+        """
+        self.generation += 1
+        self.pyramid = [self.image]
+        self.engines = [self.engine]
+        while min(self.pyramid[-1].shape[:2]) >= 2*self.MIN_PYRAMID_SIZE:
+            image = cv2.pyrDown(self.pyramid[-1])
+            self.pyramid.append(image)
+            self.engines.append(RecursionEngine(image, None, self.cache, self.profiler, self.backend))
+        self.masks = [MaskLayer() for image in self.pyramid]
+        self.level = 0
+        self.latency = {}
+        self.frames = {}
+    
+    def display_level(self):
+        """
+        returns the smallest pyramid level that still covers the canvas
+        """
+        level = 0
+        while level+1 < len(self.pyramid):
+            r,c = self.pyramid[level+1].shape[:2]
+            if c < self.realwidth or r < self.realheight:
+                break
+            level += 1
+        return level
     
     def redraw_polys(self):
         """
         handles rendering of the window and mask elements
         as well as any fragments of a new mask
-        """
-        self.delete("window")
-        self.delete("mask")
-        self.delete("new_mask")
-        
-        # redraw window
-        self.create_polygon(*self.poly.render("sharp"), tag="window")
         
-        # redraw mask elements
-        for el in self.mask_elements:
-            self.create_polygon(*self.mask.render("sharp"), tag="mask")
-        
-        # redraw new mask
-        if self.new_mask is not None:
-            self.create_polygon(*self.mask.render("sharp"), tag="new_mask")
+        the canvas items are updated in place on the next idle, so any
+        number of calls per frame cost a single update
+        """
+        self.scene.sync(self.index.polys, self.corner)
     
-    def make_recursive_image(self, dst):
+    def image_quad(self, dst, level):
         """
-        actually perform the recursive (applied iteratively)
-        operation that makes in image look like an infinite mirror
+        returns the canvas coordinates dst in the image coordinates of a pyramid level
         """
-        self.draw = self.image.copy()
+        r,c = self.pyramid[level].shape[:2]
+        return [(x*c/self.realwidth, y*r/self.realheight) for (x,y) in dst]
+    
+    def submit_render(self, level):
+        """
+        ask the render worker for the current polygon at a pyramid level,
+        replacing any request it has not started yet
+        """
+        quad = self.image_quad(self.poly, level)
+        self.worker.submit((self.engines[level], level, quad, self.method, self.corner,
+                            self.version, self.generation, None))
+    
+    @staticmethod
+    def render_job(request):
+        """
+        runs on the render worker thread, returns (patch, rect) where only the
+        rect (x,y,w,h) of the level's frame changed since the last request,
+        or the whole frame for a request to be saved
+        """
+        engine, level, quad, method, corner, version, generation, savefile = request
+        if savefile is not None:
+            return engine.render(quad, method=method, corner=corner)
+        return engine.render_dirty(quad, method=method, corner=corner)
+    
+    def collect_frames(self):
+        """
+        take finished frames from the render worker, skipping frames
+        rendered from an image that has since been replaced, which the
+        generation they were requested in tells apart even at level 0
         
-        r,c = self.imheight, self.imwidth
-        src = np.array([(0,0),(c,0),(c,r),(0,r)])
-        dst = np.array(dst)
-        hom, _ = cv2.findHomography(src, dst)
+        each result is the part of its level's frame that changed, which is
+        patched into self.frames, and self.patch grows to cover it as long as
+        that frame is the one on display
+        """
+        changed = False
+        while not self.worker.results.empty():
+            request, result, elapsed = self.worker.results.get()
+            engine, level, quad, method, corner, version, generation, savefile = request
+            if savefile is not None:
+                # saved even if another image was opened since it was asked for
+                if isinstance(result, Exception):
+                    print("save failed: %r" % result)
+                else:
+                    self.io.save(savefile, result)
+                    self.schedule_io()
+                continue
+            if isinstance(result, Exception):
+                print("render failed: %r" % result)
+                continue
+            if generation != self.generation:
+                continue
+            patch, rect = result
+            full = (0, 0, engine.imwidth, engine.imheight)
+            frame = self.frames.get(level)
+            if rect == full:
+                frame = patch
+            elif frame is None:
+                # a patch of a frame that was never collected
+                continue
+            else:
+                x,y,w,h = rect
+                frame[y:y+h, x:x+w] = patch
+            if frame is not self.draw:
+                self.patch = full
+            else:
+                self.patch = rect if self.patch is None else MaskLayer.union(self.patch, rect)
+            self.frames[level] = frame
+            self.draw, self.level, self.drawn = frame, level, version
+            self.latency[level] = elapsed
+            changed = True
+        return changed
+    
+    def report_latency(self):
+        """
+        print the most recent render time at each pyramid level, once the
+        render has been refined to full resolution with the mouse released
+        """
+        if self.mouseclick or self.level > 0 or self.drawn != self.version or self.reported == self.version:
+            return
+        self.reported = self.version
+        print("render latency: " + ", ".join(
+            "%dx%d %.1fms" % (self.pyramid[level].shape[1], self.pyramid[level].shape[0], 1000*t)
+            for level, t in sorted(self.latency.items(), reverse=True)))
+        print("render worker: %d frames, %d dropped requests, %.1fms mean frame time"
+              % (self.worker.frames, self.worker.dropped, 1000*self.worker.mean_frame_time()))
+        stats = self.cache.stats()
+        print("render cache: %d hits, %d misses, %d evictions, %.1f/%.1f MB"
+              % (stats["hits"], stats["misses"], stats["evictions"],
+                 stats["bytes"]/2**20, stats["max_bytes"]/2**20))
+    
+    def invalidate(self, *stages):
+        """
+        mark stages of the drawing as out of date and schedule a single redraw
         
-        for i in range(4):
-            masked = cv2.bitwise_and(self.draw, self.mask)
-            warp = cv2.warpPerspective(masked, hom, (c,r), flags=cv2.INTER_LINEAR)
-            cutout = cv2.fillConvexPoly(self.draw, dst, [0,0,0])
-            self.draw = cv2.bitwise_or(cutout, warp)
+        stages:
+            image:      the source image changed, rebuild the pyramid and re-render
+            mask:       the mask changed, rebuild the mask pyramid and re-render
+            geometry:   the window polygon changed, re-render
+            display:    the canvas size or rendered frame changed, re-convert for tk
+        """
+        self.dirty.update(stages)
+        if self.ready and self.redraw_timer is None:
+            self.redraw_timer = self.after_idle(self.redraw)
     
+    def update_sources(self):
+        """
+        rebuild whatever the image and mask stages depend on
+        """
+        if "image" in self.dirty:
+            self.build_pyramid()
+            self.dirty.remove("image")
+            self.dirty.add("mask" if self.mask_elements else "geometry")
+        if "mask" in self.dirty:
+            # mask elements are in canvas coordinates, each level rasterizes them
+            # at its own scale and only recomposes the part they moved in
+            for level, layer in enumerate(self.masks):
+                engine = self.engines[level]
+                r,c = engine.imheight, engine.imwidth
+                rect = layer.sync(self.mask_elements, (c,r), self.corner, (c/self.realwidth, r/self.realheight))
+                if rect[2] > 0 and rect[3] > 0:
+                    # the worker may be rendering on the current engine, so replace it
+                    self.engines[level] = engine.with_mask(layer.alpha, layer.key(), layer.flags(), rect)
+            self.engine = self.engines[0]
+            self.mask = self.engine.mask
+            self.dirty.remove("mask")
+            self.dirty.add("geometry")
+    
+    RESULT_POLL_MS = 10
     def redraw(self):
         """
-        render the screen
+        render the screen, only re-running the stages that are out of date
         """
+        self.redraw_timer = None
         self.ready = True
-        print(self.dirty)
-        if self.dirty:
-            self.make_recursive_image(self.poly)
-            self.dirty = False
-        self.disp = self.to_tkimg(self.draw)
-        self.itemconfig("img", image=self.disp)
-        self.redraw_timer = self.after(33, self.redraw) 
+        self.update_sources()
+        if self.collect_frames():
+            self.dirty.add("display")
+        self.report_latency()
+        if "geometry" in self.dirty:
+            # render at display resolution first
+            self.version += 1
+            self.submit_render(self.display_level())
+            self.dirty.remove("geometry")
+        elif (not self.mouseclick and self.level > 0 and self.drawn == self.version
+                and self.worker.idle() and self.worker.results.empty()):
+            # then progressively refine up to full resolution once the mouse is released
+            self.submit_render(self.level-1)
+        if "display" in self.dirty:
+            if self.patch is not None:
+                self.display.patch(self.draw, self.patch)
+            else:
+                self.display.show(self.draw)
+            self.patch = None
+            self.dirty.remove("display")
+            self.profiler.tick()
+            if self.hud:
+                self.draw_hud()
+        
+        # only poll while the worker has frames for us, or more refinement is to come
+        if not self.worker.idle() or not self.worker.results.empty():
+            self.redraw_timer = self.after(self.RESULT_POLL_MS, self.redraw)
+        elif not self.mouseclick and self.level > 0 and self.drawn == self.version:
+            self.redraw_timer = self.after_idle(self.redraw)
+    
+    HUD_STAGES = ("render", "homography", "raster", "mask", "warp", "composite",
+                  "remap_tables", "remap", "mip", "convert", "paste")
+    def draw_hud(self):
+        """
+        show the frame rate and the rolling mean and p95 time of each stage on the canvas
+        """
+        stats = self.profiler.stats()
+        lines = ["%.1f fps  level %d" % (self.profiler.fps(), self.level)]
+        for stage in self.HUD_STAGES:
+            if stage in stats:
+                lines.append("%-12s %7.2fms  p95 %7.2fms"
+                             % (stage, 1000*stats[stage]["mean"], 1000*stats[stage]["p95"]))
+        if not self.find_withtag("hud"):
+            self.create_text(8, 8, anchor=tk.NW, fill="#0f0", font=("Courier", 9), tag="hud")
+        self.itemconfig("hud", text="\n".join(lines))
+        self.tag_raise("hud")
     
     def load_image(self, imfile):
         """
-        load an image onto the canvas
+        load an image onto the canvas in the background, large jpegs are
+        shown from a reduced decode until the full decode is done
         """
         self.imfile = imfile
-        self.image = cv2.imread(self.imfile)
-        if self.image is None:
-            default_background()
+        self.io.load(imfile, preview_size=int(max(self.realwidth, self.realheight)))
+        self.schedule_io()
+    
+    def set_image(self, image):
+        """
+        replace the image being edited
+        """
+        self.image = image
         self.imheight, self.imwidth = self.image.shape[:2]
-        self.mask = np.full((self.imheight, self.imwidth), 255, dtype=(np.uint8, 3))
-        self.dirty = True
+        self.engine = RecursionEngine(self.image, cache=self.cache, profiler=self.profiler,
+                                      backend=self.backend)
+        self.mask = self.engine.mask
+        self.invalidate("image")
+    
+    def save_image(self, savefile):
+        """
+        save the current polygon rendered at full resolution, a frame already
+        on display at full resolution is saved straight away, otherwise the render
+        worker renders it and collect_frames saves it once it arrives, so the
+        editor never blocks on a full resolution render
+        """
+        self.update_sources()
+        if self.level == 0 and self.drawn == self.version and "geometry" not in self.dirty:
+            # the render worker patches frames in place, so the io worker gets its own copy
+            draw = self.draw.get() if isinstance(self.draw, cv2.UMat) else self.draw.copy()
+            self.io.save(savefile, draw)
+            self.schedule_io()
+            return
+        self.worker.submit((self.engines[0], 0, self.image_quad(self.poly, 0), self.method,
+                            self.corner, self.version, self.generation, savefile), keep=True)
+        self.invalidate()
+    
+    IO_POLL_MS = 20
+    def poll_io(self):
+        """
+        take finished loads and saves from the io worker, polling until it is idle
+        """
+        self.io_timer = None
+        while not self.io.results.empty():
+            kind, path, result = self.io.results.get()
+            if kind == "saved":
+                print("saved %s" % path if result is None else "save failed: %s" % result)
+            elif path != self.imfile:
+                continue    # another image was opened since
+            elif result is not None:
+                self.set_image(result)
+            elif kind == "image":
+                print("Could not read image: %s" % path)
+                self.default_background()
+                self.invalidate("image")
+        if not self.io.idle() or not self.io.results.empty():
+            self.schedule_io()
     
+    def schedule_io(self):
+        if self.io_timer is None:
+            self.io_timer = self.after(self.IO_POLL_MS, self.poll_io)
+    
+    PICK_RADIUS = 6
     def on_mouseclick(self, event):
         """
         there are two stages of the application:
@@ -222,18 +484,18 @@ class RecursiveImageGenerator(tk.Canvas):
                     or creates a new point added to the current mask element
         """
         x,y = event.x, event.y
+        self.mousex, self.mousey = x, y
         if self.shift:
-            pass
+            keys = [key for key in self.index.polys if key != "window"]
+            self.selected = self.index.nearest(x, y, self.PICK_RADIUS, keys)
+            if self.selected is None:
+                if self.new_mask is None:
+                    self.new_mask = Polygon()
+                self.new_mask.add(x, y)
+                self.index.add("new_mask", self.new_mask)
+                self.redraw_polys()
         else:
-            touch = self.find_overlapping(x-3, y-3, x+3, y+3)
-            if self.topleft in touch:
-                self.selected = self.topleft
-            if self.topright in touch:
-                self.selected = self.topright
-            if self.botright in touch:
-                self.selected = self.botright
-            if self.botleft in touch:
-                self.selected = self.botleft
+            self.selected = self.index.nearest(x, y, self.PICK_RADIUS, ("window",))
         self.mouseclick = True
     
     def on_mousemove(self, event):
@@ -244,16 +506,21 @@ class RecursiveImageGenerator(tk.Canvas):
         dx,dy = event.x - self.mousex, event.y - self.mousey
         self.mousex, self.mousey = event.x, event.y
         if self.mouseclick:
-            if self.shift:
-                self.dirty = True
-            else:
-                if self.selected is not None:
-                    x1,y1,x2,y2 = self.bbox(self.selected)
-                    corner = self.corners[self.selected]
-                    self.poly[corner] = ((x1+x2)//2, (y1+y2)//2)
-                    self.move(self.selected, dx, dy)
-                    self.redraw_polys()
-                    self.dirty = True
+            if self.selected is not None:
+                key, i = self.selected
+                self.index.polys[key].move(i, dx, dy)
+                self.index.update(key, i)
+                self.redraw_polys()
+                if key == "window":
+                    self.invalidate("geometry")
+                elif key != "new_mask":
+                    self.invalidate("mask")
+        else:
+            # show which points can be picked up
+            hover = self.index.nearest(event.x, event.y, self.PICK_RADIUS) is not None
+            if hover != self.hover:
+                self.config(cursor="hand2" if hover else "")
+                self.hover = hover
     
     def on_mousedrop(self, event):
         """
@@ -261,10 +528,36 @@ class RecursiveImageGenerator(tk.Canvas):
         """
         self.selected = None
         self.mouseclick = False
+        self.invalidate()
     
+    CORNERS = ("sharp", "bezier", "hermite")
     def on_keypress(self, event):
         key = event.keysym
         
+        if key == "c":
+            # cycle the corner interpolation of the window and mask elements
+            self.corner = self.CORNERS[(self.CORNERS.index(self.corner)+1) % len(self.CORNERS)]
+            self.redraw_polys()
+            self.invalidate("mask" if self.mask_elements else "geometry")
+        if key == "q":
+            # toggle quality mode, sampling each level from a pyramid of the source
+            self.method = "mip" if self.method == "iterative" else "iterative"
+            self.invalidate("geometry")
+        if key == "o":
+            # toggle rendering through opencv's transparent api on an OpenCL device
+            backend = "opencl" if self.backend == "numpy" else "numpy"
+            self.engines = [engine.with_backend(backend) for engine in self.engines]
+            self.engine = self.engines[0]
+            self.backend = self.engine.backend
+            if self.backend != backend:
+                print("OpenCL is not available, rendering with numpy")
+            self.invalidate("geometry")
+        if key == "p":
+            # toggle the performance overlay
+            self.hud = not self.hud
+            if not self.hud:
+                self.delete("hud")
+            self.invalidate("display")
         if key == "Shift_L":
             self.lshift = True
         if key == "Shift_R":
@@ -280,7 +573,16 @@ class RecursiveImageGenerator(tk.Canvas):
         if key == "Shift_R":
             self.rshift = False
         
-        self.shift = self.lshift or self.rshift        
+        self.shift = self.lshift or self.rshift
+        
+        # releasing shift finishes the new mask element
+        if not self.shift and self.new_mask is not None and len(self.new_mask) >= 3:
+            self.index.remove("new_mask")
+            self.index.add(("mask", len(self.mask_elements)), self.new_mask)
+            self.mask_elements.append(self.new_mask)
+            self.new_mask = None
+            self.redraw_polys()
+            self.invalidate("mask")
     
     def configure_shape(self, x, y, w, h):
         """
@@ -291,10 +593,15 @@ class RecursiveImageGenerator(tk.Canvas):
         rw, rh = self.realwidth, self.realheight
         
         self.place(x=x,y=y,width=w,height=h)
-        self.scale("window", 0, 0, w/rw, h/rh)
-        self.scale("poly", 0, 0, w/rw, h/rh)
-        self.poly = [(int(x*w/rw), int(y*h/rh)) for (x,y) in self.poly]
+        polys = [self.poly] + self.mask_elements + [p for p in [self.new_mask] if p is not None]
+        Polygon.transform_all(polys, [[w/rw, 0, 0], [0, h/rh, 0]])
+        self.index.rebuild()
+        self.redraw_polys()
         self.realwidth, self.realheight = w, h
+        if self.display.resize((w,h)):
+            self.itemconfig("img", image=self.display.photo)
+        self.invalidate("display")
 
-Interact()
+if __name__=="__main__":
+    Interact()
 
@@ -0,0 +1,124 @@
+import hashlib
+import numpy as np
+from raster import ShapeRaster
+
+class MaskLayer:
+    """
+    The MaskLayer class composes the single channel alpha mask of a set of mask
+    elements, 255 where the nested copy is kept and 0 inside the elements, with
+    anti-aliased soft edges
+
+    the coverage of each element is kept along with the box it covers, so when
+    an element is added, moved or removed only the union of its old and new box
+    is recomposed, from just the elements overlapping it
+
+    alpha is replaced by a recomposed copy rather than changed in place, so an
+    array already handed to a RecursionEngine never changes under a render
+    """
+
+    def __init__(self, raster=None):
+        self.raster = raster if raster is not None else ShapeRaster()
+        self.alpha = None       # np img - single channel mask, uint8
+        self.size = None        # (w,h) - size of alpha
+        self.recomposed = 0     # int - pixels recomposed since creation
+        self._elements = {}     # {key: (outline bytes, (x,y,w,h), coverage, (hides, partial))}
+
+    def sync(self, polys, size, corner="sharp", scale=(1,1)):
+        """
+        bring the mask up to date with the Polygons polys, whose points are
+        multiplied by scale, on a mask of the given size (w,h)
+        only elements whose outline changed are rasterized again
+        returns the rect (x,y,w,h) of the mask that changed, empty if none did
+        """
+        if size != self.size:
+            self.size = size
+            self.alpha = np.full(size[::-1], 255, dtype=np.uint8)
+            self._elements.clear()
+
+        dirty = []
+        outlines = {key: ShapeRaster.outline(poly, corner)*scale for key, poly in enumerate(polys)}
+        for key in list(self._elements):
+            if key not in outlines:
+                dirty.append(self._elements.pop(key)[1])
+        for key, outline in outlines.items():
+            old = self._elements.get(key)
+            if old is not None and old[0] == outline.tobytes():
+                continue
+            element = self.rasterize(outline)
+            self._elements[key] = element
+            dirty.append(MaskLayer.union(old[1], element[1]) if old is not None else element[1])
+
+        changed = (0,0,0,0)
+        if dirty:
+            self.alpha = self.alpha.copy()
+        for rect in dirty:
+            self.recompose(rect)
+            changed = MaskLayer.union(changed, rect)
+        return changed
+
+    def rasterize(self, outline):
+        """
+        returns (outline bytes, rect, coverage, (hides, partial)) of the closed outline
+        clipped to the mask, where hides and partial tell whether the coverage hides
+        any pixel and whether any pixel is only partially covered
+        """
+        w,h = self.size
+        if len(outline) < 3:
+            return outline.tobytes(), (0,0,0,0), None, (False, False)
+        x0,y0 = np.maximum(np.floor(outline.min(axis=0)).astype(int)-1, 0)
+        x1,y1 = np.minimum(np.ceil(outline.max(axis=0)).astype(int)+1, (w,h))
+        if x1 <= x0 or y1 <= y0:
+            return outline.tobytes(), (0,0,0,0), None, (False, False)
+        rect = (int(x0), int(y0), int(x1-x0), int(y1-y0))
+        cover = self.raster.coverage(outline, rect)
+        return outline.tobytes(), rect, cover, (bool(cover.any()), bool(np.any((cover != 0) & (cover != 255))))
+
+    def recompose(self, rect):
+        """
+        rebuild the rect (x,y,w,h) of the mask from the elements overlapping it
+        """
+        x,y,w,h = rect
+        if w <= 0 or h <= 0:
+            return
+        region = self.alpha[y:y+h, x:x+w]
+        region[...] = 255
+        for _, (ex,ey,ew,eh), cover, _ in self._elements.values():
+            x0, y0 = max(x, ex), max(y, ey)
+            x1, y1 = min(x+w, ex+ew), min(y+h, ey+eh)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            sub = region[y0-y:y1-y, x0-x:x1-x]
+            np.minimum(sub, 255-cover[y0-ey:y1-ey, x0-ex:x1-ex], out=sub)
+        self.recomposed += w*h
+
+    def flags(self):
+        """
+        returns (masked, soft) of alpha as RecursionEngine.set_mask takes them,
+        from the elements rather than a scan of the mask, soft may be set where
+        another element fully covers every partial pixel, which is only slower
+        """
+        flags = [element[3] for element in self._elements.values()]
+        return any(hides for hides, _ in flags), any(partial for _, partial in flags)
+
+    def key(self):
+        """
+        returns a digest of the size and element outlines, which are all alpha
+        depends on, for use as its cache key
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(str(self.size).encode())
+        for key in sorted(self._elements):
+            outline = self._elements[key][0]
+            h.update(len(outline).to_bytes(8, "little") + outline)
+        return h.hexdigest()
+
+    @staticmethod
+    def union(a, b):
+        """ returns the bounding box of the rects a and b (x,y,w,h), ignoring empty ones """
+        if a[2] <= 0 or a[3] <= 0:
+            return b
+        if b[2] <= 0 or b[3] <= 0:
+            return a
+        x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+        x1, y1 = max(a[0]+a[2], b[0]+b[2]), max(a[1]+a[3], b[1]+b[3])
+        return (x0, y0, x1-x0, y1-y0)
@@ -1,72 +1,154 @@
+import math
+import numpy as np
+
 class Polygon:
     """
     The Polygon class defines a construct for storing points in a polygon, as well as some helper functions for modifying its position and scaling
+    
+    points are stored in a single (capacity, 2) float array that grows by doubling,
+    xpts, ypts, pts and flat are views into it rather than copies
     """
     
+    __slots__ = ("_buf", "_n")
+    
     def __init__(self, pts=None):
-        if pts is None:
-            pts = [[],[]]
-        self.xpts = [p[0] for p in pts]
-        self.ypts = [p[1] for p in pts]
+        pts = np.array(pts if pts is not None else [], dtype=np.float64).reshape(-1, 2)
+        self._buf = pts.copy() if pts.base is not None else pts
+        self._n = len(pts)
+    
+    @property
+    def pts(self):
+        """ (n,2) view of the points in this Polygon """
+        return self._buf[:self._n]
+    
+    @property
+    def xpts(self):
+        return self._buf[:self._n, 0]
+    
+    @property
+    def ypts(self):
+        return self._buf[:self._n, 1]
+    
+    @property
+    def flat(self):
+        """ x0,y0,x1,y1,... view of the points, e.g. for canvas.coords(item, *poly.flat) """
+        return self._buf[:self._n].reshape(-1)
+    
+    def copy(self):
+        return Polygon(self.pts)
     
     def add(self, x, y):
         """
         adds the point (x,y) between this Polygon's (k-1)th and 0th elements
         """
-        self.xpts.append(x)
-        self.ypts.append(y)
+        if self._n == len(self._buf):
+            buf = np.empty((max(4, 2*len(self._buf)), 2), dtype=np.float64)
+            buf[:self._n] = self._buf[:self._n]
+            self._buf = buf
+        self._buf[self._n] = (x, y)
+        self._n += 1
     
     def __setitem__(self, i, pt):
         """
         directly modifies a given point in this Polygon
         """
-        assert -i <= len(self.xpts), "Invalid index: " + str(i)
-        assert i < len(self.xpts), "Invalid index: " + str(i) + " >= " + str(len(self.xpts))
-        self.xpts[i] = pt[0]
-        self.ypts[i] = pt[1]
+        assert -i <= self._n, "Invalid index: " + str(i)
+        assert i < self._n, "Invalid index: " + str(i) + " >= " + str(self._n)
+        self.pts[i] = pt
     
     def __getitem__(self, i):
         """
         returns the i-th point in this Polygon
         """
-        assert -i <= len(self.xpts), "Invalid index: " + str(i)
-        assert i < len(self.xpts), "Invalid index: " + str(i) + " >= " + str(len(self.xpts))
-        return self.xpts[i], self.ypts[i]
+        assert -i <= self._n, "Invalid index: " + str(i)
+        assert i < self._n, "Invalid index: " + str(i) + " >= " + str(self._n)
+        x, y = self.pts[i]
+        return float(x), float(y)
     
     def __len__(self):
-        return len(self.xpts)
+        return self._n
+    
+    def __iter__(self):
+        """
+        iterates over the (x,y) points in this Polygon
+        """
+        return map(tuple, self.pts.tolist())
     
     def move(self, i, dx, dy):
         """
         moves the i-th point in this Polygon by dx in the x direction and dy in the y direction
         """
-        assert -i <= len(self.xpts), "Invalid index: " + str(i)
-        assert i < len(self.xpts), "Invalid index: " + str(i) + " >= " + str(len(self.xpts))
-        self.xpts[i] += dx
-        self.ypts[i] += dy
+        assert -i <= self._n, "Invalid index: " + str(i)
+        assert i < self._n, "Invalid index: " + str(i) + " >= " + str(self._n)
+        self.pts[i] += (dx, dy)
+    
+    def translate(self, dx, dy):
+        """
+        moves this entire Polygon by dx in the x direction and dy in the y direction
+        """
+        self.pts[:] += (dx, dy)
+        return self
     
     def scale(self, mx, my):
         """
         scales this entire Polygon by a magnitude of mx in the x axis and my in the y axis
         """
-        for i in range(len(xpts)):
-            self.xpts[i] *= mx
-            self.ypts[i] *= my
+        self.pts[:] *= (mx, my)
+        return self
+    
+    def affine(self, mat):
+        """
+        applies the 2x3 affine matrix mat to this entire Polygon
+        """
+        mat = np.asarray(mat, dtype=np.float64)
+        self.pts[:] = self.pts @ mat[:, :2].T + mat[:, 2]
+        return self
+    
+    def homography(self, hom):
+        """
+        applies the 3x3 homography hom to this entire Polygon
+        """
+        self.pts[:] = Polygon.project(hom, self.pts)
+        return self
     
     def select(self, x, y, r):
         """
         returns the index of the point in this Polygon closest to (x,y) and within r units
         returns None if no such point exists
         """
-        min_i, min_d = 0, sys.maxsize
-        for i, (h,k) in enumerate(zip(xpts, ypts)):
-            if abs(h-x) > r or abs(k-y) > r:
-                continue
-            d = (h-x)**2 + (k-y)**2
-            if d <= r*r:
-                min_d = d
-                min_i = i
-        return i if d < sys.maxsize else None
+        if not self._n:
+            return None
+        d = ((self.pts - (x, y))**2).sum(axis=1)
+        i = int(d.argmin())
+        return i if d[i] <= r*r else None
+    
+    @staticmethod
+    def project(hom, pts):
+        """ returns the (n,2) points pts transformed by the 3x3 homography hom """
+        hom = np.asarray(hom, dtype=np.float64)
+        out = pts @ hom[:2, :2].T + hom[:2, 2]
+        w = pts @ hom[2, :2] + hom[2, 2]
+        return out/w[:, None]
+    
+    @staticmethod
+    def transform_all(polys, mat):
+        """
+        applies a 2x3 affine or 3x3 homography mat to every Polygon in polys at once,
+        gathering all their points into one array so the transform is a single operation
+        """
+        polys = [p for p in polys if len(p)]
+        if not polys:
+            return
+        pts = np.concatenate([p.pts for p in polys])
+        mat = np.asarray(mat, dtype=np.float64)
+        if mat.shape == (3,3):
+            pts = Polygon.project(mat, pts)
+        else:
+            pts = pts @ mat[:, :2].T + mat[:, 2]
+        start = 0
+        for p in polys:
+            p.pts[:] = pts[start:start+len(p)]
+            start += len(p)
     
     NUM_INTERP_SEGS = 20
     def render(self, corner="sharp", flat=False):
@@ -80,44 +162,111 @@ class Polygon:
         """
                 
         if corner == "sharp":
-            return [self.xpts, self.ypts] if not flat else Polygon.flatten(self.xpts, self.ypts)
+            return [self.xpts.tolist(), self.ypts.tolist()] if not flat else self.flat.tolist()
         
-        elif corner == "bezier":
-            x, y = [], []
-            numsegs = (len(self.xpts)+1)*Polygon.NUM_INTERP_SEGS
-            for segment in range(numsegs+1):
-                t = segment/numsegs
-                x.append(Polygon.bezier(self.xpts, t))
-                y.append(Polygon.bezier(self.ypts, t))
+        elif corner in ("bezier", "hermite"):
+            pts = self.render_array(corner)
+            x, y = pts[:,0].tolist(), pts[:,1].tolist()
             return [x,y] if not flat else Polygon.flatten(x,y)
         
+        raise ValueError("Invalid corner type: %s" % corner)
+    
+    def render_array(self, corner="sharp", closed=False):
+        """
+        returns the same points as render as an (n,2) numpy array,
+        evaluating every sample of a curve at once with cached basis matrices
+        
+        if closed, the curve also runs smoothly from the last point back to the first,
+        so it can be filled as a shape
+        """
+        pts = self.pts.copy()
+        if corner == "sharp":
+            return pts
+        
+        elif corner == "bezier":
+            if closed:
+                pts = np.vstack([pts, pts[:1]])
+            numsegs = (len(pts)+1)*Polygon.NUM_INTERP_SEGS
+            return Polygon.bernstein_matrix(len(pts)-1, numsegs) @ pts
+        
         elif corner == "hermite":
-            x, y = [], []
-            for k in range(len(self.xpts)-1):
-                for segment in range(Polygon.NUM_INTERP_SEGS+(k==len(self.xpts)-2)):
-                    t_k = segment / Polygon.NUM_INTERP_SEGS
-                    x.append(Polygon.hermite(self.xpts, t_k, k))
-                    y.append(Polygon.hermite(self.ypts, t_k, k))
-            return [x,y] if not flat else Polygon.flatten(x,y)
+            if len(pts) < 2:
+                return pts[:0]
+            n, segs = len(pts), Polygon.NUM_INTERP_SEGS
+            if closed:
+                # tangents and segments wrap around
+                k = np.arange(n)
+                p_k0, p_k1 = pts[k], pts[(k+1)%n]
+                m_k0 = (pts[(k+1)%n]-pts[k-1])/2
+                m_k1 = (pts[(k+2)%n]-pts[k])/2
+            else:
+                k = np.arange(n-1)
+                p_k0, p_k1 = pts[k], pts[k+1]
+                m_k0 = (pts[k+1]-pts[np.maximum(0, k-1)])/2     # finite difference tangents
+                m_k1 = (pts[np.minimum(n-1, k+2)]-pts[k])/2
+            # (segments, samples, 4) @ (segments, 4, 2) -> every sample of every segment
+            ctrl = np.stack([p_k0, m_k0, p_k1, m_k1], axis=1)
+            curve = (Polygon.hermite_matrix(segs+1)[None] @ ctrl)
+            # each segment ends where the next begins, only the last keeps t=1
+            if closed:
+                return curve[:,:-1].reshape(-1, 2)
+            return np.concatenate([curve[:,:-1].reshape(-1, 2), curve[-1,-1:]])
         
         raise ValueError("Invalid corner type: %s" % corner)
     
+    @staticmethod
+    def lerp(a, b, t):
+        """
+        returns the Polygon a fraction t of the way from a to b point by point,
+        a and b must have the same number of points
+        """
+        assert len(a) == len(b), "Polygons differ in length: %d != %d" % (len(a), len(b))
+        return Polygon(a.pts + t*(b.pts-a.pts))
+    
     @staticmethod
     def flatten(x, y):
         """ returns the flattened zipped list version of x,y """
         return [j for i in zip(x, y) for j in i]
 
 
-    CHOOSE_MEM = {}
     @staticmethod
     def choose(n,k):
-        if (n,k) in Polygon.CHOOSE_MEM:
-            return Polygon.CHOOSE_MEM[(n,k)]
-        if 0 < k <= n:
-            f = Polygon.choose(n-1, k-1) + Polygon.choose(n-1,k)
-            Polygon.CHOOSE_MEM[(n,k)] = f
-            return f
-        return int(not k)
+        return math.comb(n,k)
+    
+    BASIS_MEM = {}
+    @staticmethod
+    def bernstein_matrix(degree, numsegs):
+        """
+        returns the (numsegs+1, degree+1) matrix of bernstein polynomials at t = i/numsegs,
+        evaluated in log space since binomials and powers of t overflow for high degrees
+        """
+        key = ("bezier", degree, numsegs)
+        if key not in Polygon.BASIS_MEM:
+            t = np.linspace(0, 1, numsegs+1)[:,None]
+            j = np.arange(degree+1)
+            i = np.arange(1, degree+1)
+            log_binom = np.concatenate([[0], np.cumsum(np.log(degree-i+1) - np.log(i))])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                log_basis = log_binom + j*np.log(t) + (degree-j)*np.log1p(-t)
+            basis = np.exp(log_basis)
+            # 0*log(0) terms at the endpoints
+            basis[0], basis[-1] = 0, 0
+            basis[0,0], basis[-1,-1] = 1, 1
+            Polygon.BASIS_MEM[key] = basis
+        return Polygon.BASIS_MEM[key]
+
+    @staticmethod
+    def hermite_matrix(numsamples):
+        """
+        returns the (numsamples, 4) matrix of the hermite basis functions
+        h_00, h_10, h_01, h_11 at t = i/(numsamples-1)
+        """
+        key = ("hermite", 3, numsamples)
+        if key not in Polygon.BASIS_MEM:
+            t = np.linspace(0, 1, numsamples)
+            Polygon.BASIS_MEM[key] = np.column_stack([Polygon.HERM_00(t), Polygon.HERM_10(t),
+                                                      Polygon.HERM_01(t), Polygon.HERM_11(t)])
+        return Polygon.BASIS_MEM[key]
     
     @staticmethod    
     def bezier(ctrl_pts, t):
@@ -0,0 +1,115 @@
+import json
+import time
+import threading
+import contextlib
+import collections
+import numpy as np
+
+class Profiler:
+    """
+    The Profiler class records named timing spans from any thread
+
+    the most recent durations of each span are kept for rolling statistics and
+    histograms, and every span is also kept as a trace event, so a session can be
+    exported in the chrome trace event format and loaded in chrome://tracing or
+    https://ui.perfetto.dev
+    """
+
+    def __init__(self, window=240, max_events=200000):
+        self.window = window        # int - durations kept per span name
+        self.enabled = True         # bool - whether spans are recorded at all
+        self._durations = {}        # {name: deque of seconds}
+        self._ticks = collections.deque(maxlen=window)     # perf_counter of each frame
+        self._events = collections.deque(maxlen=max_events)
+        self._threads = {}          # {thread ident: thread name}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """
+        times the body of a with statement as the span name
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+        """
+        records a span that ran from start to end, both perf_counter times
+        """
+        tid = threading.get_ident()
+        with self._lock:
+            if tid not in self._threads:
+                self._threads[tid] = threading.current_thread().name
+            if name not in self._durations:
+                self._durations[name] = collections.deque(maxlen=self.window)
+            self._durations[name].append(end-start)
+            self._events.append((name, start, end, tid))
+
+    def tick(self):
+        """
+        marks a finished frame, for fps
+        """
+        with self._lock:
+            self._ticks.append(time.perf_counter())
+
+    def fps(self):
+        """ returns the frame rate over the rolling window of ticks """
+        with self._lock:
+            ticks = list(self._ticks)
+        if len(ticks) < 2 or ticks[-1] == ticks[0]:
+            return 0.0
+        return (len(ticks)-1)/(ticks[-1]-ticks[0])
+
+    def stats(self):
+        """
+        returns {name: {count, mean, p50, p95, p99, max, last}} in seconds over
+        the rolling window of each span
+        """
+        with self._lock:
+            durations = {name: np.array(d) for name, d in self._durations.items() if d}
+        return {name: {"count": len(d), "mean": float(d.mean()), "p50": float(np.percentile(d, 50)),
+                       "p95": float(np.percentile(d, 95)), "p99": float(np.percentile(d, 99)),
+                       "max": float(d.max()), "last": float(d[-1])}
+                for name, d in durations.items()}
+
+    HISTOGRAM_EDGES = [0, 1e-4, 3e-4, 1e-3, 3e-3, 1e-2, 3e-2, 1e-1, 3e-1, 1, float("inf")]
+    def histogram(self, name, edges=HISTOGRAM_EDGES):
+        """
+        returns the counts of the rolling durations of span name between
+        consecutive edges, in seconds
+        """
+        with self._lock:
+            durations = list(self._durations.get(name, ()))
+        counts, _ = np.histogram(durations, bins=edges)
+        return counts.tolist()
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._ticks.clear()
+            self._events.clear()
+
+    def export_trace(self, path):
+        """
+        writes the recorded spans to path as chrome trace event json,
+        returns the number of events written
+        """
+        with self._lock:
+            events = list(self._events)
+            names = dict(self._threads)
+        threads = {tid: n for n, tid in enumerate(sorted({e[3] for e in events}))}
+        trace = [{"name": name, "ph": "X", "pid": 1, "tid": threads[tid],
+                  "ts": 1e6*(start-self._origin), "dur": 1e6*(end-start)}
+                 for name, start, end, tid in events]
+        trace += [{"name": "thread_name", "ph": "M", "pid": 1, "tid": n,
+                   "args": {"name": names[tid]}} for tid, n in threads.items()]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        return len(events)
@@ -0,0 +1,72 @@
+import cv2
+import threading
+import numpy as np
+from collections import OrderedDict
+from polygon import Polygon
+
+class ShapeRaster:
+    """
+    The ShapeRaster class rasterizes outlines into anti-aliased alpha masks
+
+    the most recent rasters are kept, keyed by the outline points and the target
+    rectangle, so a shape is only re-rasterized when its points change
+    """
+
+    SUBPIXEL_BITS = 4   # fixed point bits used for sub-pixel accurate edges
+
+    def __init__(self, size=32):
+        self.size = size
+        self.rasterized = 0     # int - number of rasters actually drawn
+        self._rasters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def coverage(self, outline, rect):
+        """
+        returns the uint8 coverage (0-255) of the closed outline, an (n,2) array of
+        points, inside the rect (x,y,w,h) of the image it was given in
+        """
+        outline = np.asarray(outline, dtype=np.float64)
+        key = ("coverage", outline.tobytes(), tuple(rect))
+        with self._lock:
+            if key in self._rasters:
+                self._rasters.move_to_end(key)
+                return self._rasters[key]
+
+        x,y,w,h = rect
+        raster = np.zeros((h,w), dtype=np.uint8)
+        if len(outline) >= 3:
+            pts = np.round((outline - (x,y))*(1 << self.SUBPIXEL_BITS)).astype(np.int32)
+            cv2.fillPoly(raster, [pts], 255, lineType=cv2.LINE_AA, shift=self.SUBPIXEL_BITS)
+        return self._store(key, raster)
+
+    def weights(self, outline, rect):
+        """
+        returns the float32 alpha and 1-alpha of the outline inside rect,
+        ready for cv2.blendLinear
+        """
+        outline = np.asarray(outline, dtype=np.float64)
+        key = ("weights", outline.tobytes(), tuple(rect))
+        with self._lock:
+            if key in self._rasters:
+                self._rasters.move_to_end(key)
+                return self._rasters[key]
+        alpha = self.coverage(outline, rect).astype(np.float32)/255
+        return self._store(key, (alpha, 1-alpha))
+
+    def _store(self, key, value):
+        with self._lock:
+            self.rasterized += 1
+            self._rasters[key] = value
+            while len(self._rasters) > self.size:
+                self._rasters.popitem(last=False)
+        return value
+
+    @staticmethod
+    def outline(poly, corner="sharp"):
+        """
+        returns the closed outline of poly, a Polygon or a sequence of points,
+        as an (n,2) array using the given corner interpolation
+        """
+        if not isinstance(poly, Polygon):
+            poly = Polygon(poly)
+        return poly.render_array(corner, closed=True)
@@ -0,0 +1,51 @@
+class CanvasScene:
+    """
+    The CanvasScene class keeps one canvas polygon item per Polygon and updates
+    it in place with coords, instead of deleting and recreating every item
+
+    polygons are keyed like PointIndex, "window", ("mask", i) and "new_mask", and
+    the key (or its first element) is the item's tag, changes are batched into a
+    single idle callback, which only touches items whose points or corner changed
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.items = {}         # {key: canvas item id}
+        self.updated = 0        # int - number of items created or moved
+        self._state = {}        # {key: (point bytes, corner)} - as last drawn
+        self._pending = None    # ({key: Polygon}, corner) - to draw on idle
+        self._timer = None
+
+    def sync(self, polys, corner="sharp"):
+        """
+        make the items match the Polygons polys {key: Polygon} on the next idle,
+        repeated calls before then are folded into one update
+        """
+        self._pending = (dict(polys), corner)
+        if self._timer is None:
+            self._timer = self.canvas.after_idle(self.flush)
+
+    def flush(self):
+        """
+        apply the pending update now
+        """
+        self._timer = None
+        if self._pending is None:
+            return
+        polys, corner = self._pending
+        self._pending = None
+        for key in [key for key in self.items if key not in polys]:
+            self.canvas.delete(self.items.pop(key))
+            del self._state[key]
+        for key, poly in polys.items():
+            state = (poly.pts.tobytes(), corner)
+            if self._state.get(key) == state:
+                continue
+            coords = poly.render(corner, flat=True)
+            if key in self.items:
+                self.canvas.coords(self.items[key], coords)
+            else:
+                tag = key if isinstance(key, str) else key[0]
+                self.items[key] = self.canvas.create_polygon(coords, tag=tag)
+            self._state[key] = state
+            self.updated += 1
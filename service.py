@@ -0,0 +1,379 @@
+"""
+long running render service, which keeps engines and decoded images warm between
+jobs instead of paying for a new process and a fresh decode on every render
+
+    python service.py --port 8765                   # http on 127.0.0.1:8765
+    python service.py --socket /tmp/infmirror.sock  # http over a unix socket
+
+endpoints:
+    POST /render    a json job as in batch.py, relative to --root, "output" is
+                    optional, without it the render is returned as the response
+                    body, encoded as "format" ("png", "jpg" or "webp", default png)
+    GET  /metrics   json queue depth, request counts, latency percentiles and
+                    the hit rates of the engine and render caches
+    GET  /health    "ok"
+
+jobs wait in a bounded queue for a pool of worker threads, when the queue is full
+/render answers 503 with a Retry-After header straight away rather than piling up
+"""
+import os
+import cv2
+import json
+import time, sys
+import queue
+import socket
+import argparse
+import threading
+import numpy as np
+import socketserver
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cache import RenderCache
+from engine import RecursionEngine
+from fileio import ImageIO
+from profiler import Profiler
+from batch import DEFAULT_DEPTH, DEFAULT_METHOD
+
+CONTENT_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+CORNERS = ("sharp", "bezier", "hermite")
+
+class RenderJob:
+    """
+    The RenderJob class is a queued job and the result its worker fills in
+    """
+
+    def __init__(self, job):
+        self.job = job                      # dict - the job as submitted
+        self.queued = time.perf_counter()   # float - perf_counter when it was queued
+        self.result = None                  # (content type, bytes) or a dict for written outputs
+        self.error = None                   # Exception - raised by the render, or None
+        self.cancelled = False              # bool - the client gave up, skip it if not started
+        self.done = threading.Event()
+
+class RenderService:
+    """
+    The RenderService class renders jobs on a pool of worker threads, fed by a
+    bounded queue that refuses new jobs when it is full
+
+    engines are kept in a least recently used table keyed by the input and mask
+    paths and their modification times, so a repeated image is decoded and hashed
+    once, and all engines share one RenderCache and Profiler
+    """
+
+    def __init__(self, root=".", workers=4, queue_size=32, engines=8, cache_bytes=512*2**20):
+        self.root = os.path.realpath(root)  # str - job paths are resolved under it
+        self.cache = RenderCache(cache_bytes)
+        self.profiler = Profiler(window=1000, max_events=0)
+        self.max_engines = engines          # int - engines kept warm
+        self.engine_hits, self.engine_misses = 0, 0
+        self.counts = {"accepted": 0, "rejected": 0, "completed": 0,
+                       "failed": 0, "timed_out": 0}
+        self.in_flight = 0                  # int - jobs a worker is rendering
+        self._engines = OrderedDict()       # {(paths, mtimes): RecursionEngine}
+        self._loading = {}                  # {(paths, mtimes): threading.Event} - decodes in flight
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._run, name="render-%d" % i, daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job):
+        """
+        queue job and return its RenderJob, raises queue.Full if the queue is full
+        and ValueError if the job is invalid, before it takes a place in the queue
+        """
+        RenderService.validate(job)
+        pending = RenderJob(job)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            self.count("rejected")
+            raise
+        self.count("accepted")
+        return pending
+
+    @staticmethod
+    def validate(job):
+        """
+        raises ValueError unless job names an input, a window of 4 finite points
+        and known depth, method, corner and format values
+        """
+        if not isinstance(job.get("input"), str):
+            raise ValueError("Job needs an input path")
+        try:
+            window = np.array(job.get("window"), dtype=np.float64)
+        except (ValueError, TypeError):
+            raise ValueError("Window must be 4 (x,y) points: %r" % (job.get("window"),))
+        if window.shape != (4,2) or not np.isfinite(window).all():
+            raise ValueError("Window must be 4 finite (x,y) points: %r" % (job.get("window"),))
+        depth = job.get("depth", DEFAULT_DEPTH)
+        if depth != "auto" and (type(depth) is not int or not 0 <= depth <= RecursionEngine.MAX_DEPTH):
+            raise ValueError("Depth must be \"auto\" or an integer from 0 to %d: %r"
+                             % (RecursionEngine.MAX_DEPTH, depth))
+        if job.get("method", DEFAULT_METHOD) not in RecursionEngine.METHODS:
+            raise ValueError("Invalid render method: %s" % job.get("method"))
+        if job.get("corner", "sharp") not in CORNERS:
+            raise ValueError("Invalid corner type: %s" % job.get("corner"))
+        ext = "." + str(job.get("format", "png")).lower().lstrip(".")
+        if not job.get("output") and ext not in CONTENT_TYPES:
+            raise ValueError("Unsupported format: %s" % job.get("format"))
+
+    def wait(self, pending, timeout=None):
+        """
+        returns the result of pending once it is rendered, raises TimeoutError if
+        that takes longer than timeout seconds, or whatever the render raised
+        """
+        if not pending.done.wait(timeout):
+            pending.cancelled = True
+            self.count("timed_out")
+            raise TimeoutError("Render took longer than %ss" % timeout)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _run(self):
+        while True:
+            pending = self._queue.get()
+            if pending.cancelled:
+                continue
+            start = time.perf_counter()
+            self.profiler.record("queue", pending.queued, start)
+            with self._lock:
+                self.in_flight += 1
+            try:
+                pending.result = self.run_job(pending.job)
+                self.count("completed")
+            except Exception as e:
+                pending.error = e
+                self.count("failed")
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self.profiler.record("job", start, time.perf_counter())
+                pending.done.set()
+
+    def run_job(self, job):
+        """
+        render job, returns (content type, encoded bytes), or a dict of the output
+        path and size if the job names an output to write
+        """
+        engine = self.engine(job["input"], job.get("mask"))
+        draw = engine.render(job["window"], job.get("depth", DEFAULT_DEPTH),
+                             job.get("method", DEFAULT_METHOD), job.get("min_area", 1.0),
+                             job.get("corner", "sharp"))
+        with self.profiler.span("encode"):
+            if job.get("output"):
+                path = self.resolve(job["output"])
+                ImageIO.write(path, draw, job.get("encoder"))
+                return {"output": job["output"], "width": draw.shape[1], "height": draw.shape[0]}
+            ext = "." + job.get("format", "png").lower().lstrip(".")
+            if ext not in CONTENT_TYPES:
+                raise ValueError("Unsupported format: %s" % job.get("format"))
+            return CONTENT_TYPES[ext], ImageIO.encode(ext, draw, job.get("encoder"))
+
+    def engine(self, input, mask=None):
+        """
+        returns the warm engine for the image and mask paths, decoding them only
+        if they have not been seen or changed on disk since
+
+        concurrent misses for the same paths wait for the first one's decode
+        instead of each decoding them, and retry if it fails
+        """
+        paths = [self.resolve(input)] + ([self.resolve(mask)] if mask else [])
+        key = tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+        while True:
+            with self._lock:
+                engine = self._engines.get(key)
+                if engine is not None:
+                    self._engines.move_to_end(key)
+                    self.engine_hits += 1
+                    return engine
+                loading = self._loading.get(key)
+                if loading is None:
+                    self.engine_misses += 1
+                    loading = self._loading[key] = threading.Event()
+                    break
+            loading.wait()
+
+        try:
+            with self.profiler.span("load"):
+                image = cv2.imread(paths[0])
+                if image is None:
+                    raise IOError("Could not read image: %s" % input)
+                alpha = None
+                if mask:
+                    alpha = ImageIO.read_mask(paths[1])
+                    if alpha is None:
+                        raise IOError("Could not read mask: %s" % mask)
+                engine = RecursionEngine(image, alpha, self.cache, self.profiler)
+
+            with self._lock:
+                self._engines[key] = engine
+                while len(self._engines) > self.max_engines:
+                    self._engines.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._loading[key]
+            loading.set()
+        return engine
+
+    def resolve(self, path):
+        """
+        returns path resolved under root, raises ValueError if it leaves root
+        """
+        full = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, full]) != self.root:
+            raise ValueError("Path is outside the service root: %s" % path)
+        return full
+
+    def metrics(self):
+        """
+        returns a json-able dict of the queue, request counts, latencies in
+        milliseconds and cache statistics
+        """
+        with self._lock:
+            counts = dict(self.counts)
+            in_flight = self.in_flight
+            lookups = self.engine_hits + self.engine_misses
+            engines = {"entries": len(self._engines), "max_entries": self.max_engines,
+                       "hits": self.engine_hits, "misses": self.engine_misses,
+                       "hit_rate": self.engine_hits/lookups if lookups else 0.0}
+        latency = {name: {stat: (1000*value if stat != "count" else value)
+                          for stat, value in stats.items()}
+                   for name, stats in self.profiler.stats().items()}
+        return {
+            "queue": {"depth": self._queue.qsize(), "capacity": self._queue.maxsize,
+                      "in_flight": in_flight, "workers": len(self._workers)},
+            "requests": counts,
+            "latency_ms": latency,
+            "cache": {"engines": engines, "renders": self.cache.stats()},
+        }
+
+class RenderHandler(BaseHTTPRequestHandler):
+    """
+    The RenderHandler class answers the http endpoints of a RenderService,
+    which the server holds as server.service
+    """
+
+    MAX_BODY = 1 << 20
+    RETRY_AFTER = 1
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.reply(200, "text/plain", b"ok")
+        elif self.path == "/metrics":
+            self.reply_json(200, self.server.service.metrics())
+        else:
+            self.reply_json(404, {"error": "Not found: %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/render":
+            self.reply_json(404, {"error": "Not found: %s" % self.path})
+            return
+        service = self.server.service
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > RenderHandler.MAX_BODY:
+                raise ValueError("Job is larger than %d bytes" % RenderHandler.MAX_BODY)
+            job = json.loads(self.rfile.read(length))
+            if not isinstance(job, dict):
+                raise ValueError("Job must be a json object")
+            result = service.wait(service.submit(job), self.server.render_timeout)
+        except queue.Full:
+            self.reply_json(503, {"error": "Render queue is full"},
+                            {"Retry-After": str(RenderHandler.RETRY_AFTER)})
+            return
+        except TimeoutError as e:
+            self.reply_json(504, {"error": str(e)})
+            return
+        except (KeyError, ValueError, TypeError, OSError) as e:
+            self.reply_json(400, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+        except Exception as e:
+            self.reply_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+        service.profiler.record("request", start, time.perf_counter())
+        if isinstance(result, dict):
+            self.reply_json(200, result)
+        else:
+            self.reply(200, *result)
+
+    def reply(self, code, content_type, body, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def reply_json(self, code, obj, headers=None):
+        self.reply(code, "application/json", json.dumps(obj).encode(), headers)
+
+    def address_string(self):
+        # unix socket clients have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    The UnixHTTPServer class is a ThreadingHTTPServer listening on a unix socket
+    """
+    daemon_threads = True
+
+def make_server(service, host="127.0.0.1", port=8765, unix_socket=None, timeout=60.0, verbose=False):
+    """
+    returns an http server for service on host:port, or on the unix_socket path if given
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixHTTPServer(unix_socket, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.service = service
+    server.render_timeout = timeout
+    server.verbose = verbose
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve infinite mirror renders over http")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--socket", help="listen on this unix socket path instead")
+    parser.add_argument("--root", default=".", help="directory job paths are relative to")
+    parser.add_argument("-w", "--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="number of render threads")
+    parser.add_argument("--queue", type=int, default=32, help="jobs allowed to wait for a worker")
+    parser.add_argument("--engines", type=int, default=8, help="decoded images kept warm")
+    parser.add_argument("--cache-mb", type=int, default=512, help="render cache size in MB")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds a request may wait")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    if args.socket is not None and not hasattr(socket, "AF_UNIX"):
+        parser.error("unix sockets are not available on this platform")
+    service = RenderService(args.root, args.workers, args.queue, args.engines, args.cache_mb*2**20)
+    server = make_server(service, args.host, args.port, args.socket, args.timeout, args.verbose)
+    print("serving on %s" % (args.socket or "http://%s:%d" % (args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
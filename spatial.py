@@ -0,0 +1,143 @@
+import math
+from collections import defaultdict
+
+class PointIndex:
+    """
+    The PointIndex class is a uniform grid over the points and edges of a set of
+    closed Polygons, used to pick the point under the mouse and the polygons
+    containing it without scanning every polygon
+
+    each polygon is registered under a key, points are stored in the cell they fall in
+    and edges in every cell their bounding box touches, moving a point only updates
+    the cells of that point and its two edges
+    """
+
+    def __init__(self, cell=16):
+        self.cell = cell
+        self.polys = {}                     # {key: Polygon}
+        self._pts = {}                      # {key: [(x,y)]} - positions as last indexed
+        self._points = defaultdict(set)     # {(cx,cy): {(key, i)}}
+        self._edges = defaultdict(set)      # {(cx,cy): {(key, i)}} - edge from point i to i+1
+        self._right = 0                     # int - rightmost cell column any edge reached
+
+    def __contains__(self, key):
+        return key in self.polys
+
+    def add(self, key, poly):
+        """
+        index poly under key, replacing whatever was indexed under it before
+        """
+        if key in self.polys:
+            self.remove(key)
+        self.polys[key] = poly
+        self._pts[key] = list(poly)
+        for i in range(len(poly)):
+            self._insert_point(key, i)
+            self._insert_edge(key, i)
+
+    def remove(self, key):
+        poly = self.polys.pop(key)
+        for i in range(len(self._pts[key])):
+            self._delete_point(key, i)
+            self._delete_edge(key, i)
+        del self._pts[key]
+        return poly
+
+    def update(self, key, i):
+        """
+        reindex point i of the polygon under key after it moved
+        """
+        pts = self._pts[key]
+        n = len(pts)
+        self._delete_point(key, i)
+        self._delete_edge(key, (i-1) % n)
+        self._delete_edge(key, i)
+        pts[i] = self.polys[key][i]
+        self._insert_point(key, i)
+        self._insert_edge(key, (i-1) % n)
+        self._insert_edge(key, i)
+
+    def rebuild(self):
+        """
+        reindex everything, e.g. after the polygons were transformed in bulk
+        """
+        polys = list(self.polys.items())
+        self.polys.clear()
+        self._pts.clear()
+        self._points.clear()
+        self._edges.clear()
+        self._right = 0
+        for key, poly in polys:
+            self.add(key, poly)
+
+    def nearest(self, x, y, r, keys=None):
+        """
+        returns (key, i) of the point closest to (x,y) and within r units,
+        optionally only among the given keys, or None if no such point exists
+        """
+        best, best_d = None, r*r
+        for cell in self._cells(x-r, y-r, x+r, y+r):
+            for key, i in self._points.get(cell, ()):
+                if keys is not None and key not in keys:
+                    continue
+                px, py = self._pts[key][i]
+                d = (px-x)**2 + (py-y)**2
+                if d <= best_d:
+                    best, best_d = (key, i), d
+        return best
+
+    def containing(self, x, y):
+        """
+        returns the keys of the polygons containing (x,y)
+
+        casts a ray to the right of (x,y), only the edges registered in the cells
+        along that ray can cross it, so only those are tested
+        """
+        cx, cy = self._cell(x, y)
+        crossings = defaultdict(int)
+        seen = set()
+        for ix in range(cx, self._right+1):
+            for key, i in self._edges.get((ix, cy), ()):
+                if (key, i) in seen:
+                    continue
+                seen.add((key, i))
+                pts = self._pts[key]
+                (x0,y0), (x1,y1) = pts[i], pts[(i+1) % len(pts)]
+                if (y0 > y) != (y1 > y) and x < x0 + (y-y0)*(x1-x0)/(y1-y0):
+                    crossings[key] += 1
+        return [key for key, n in crossings.items() if n % 2]
+
+    def _cell(self, x, y):
+        return math.floor(x/self.cell), math.floor(y/self.cell)
+
+    def _cells(self, x0, y0, x1, y1):
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+        return [(cx, cy) for cx in range(cx0, cx1+1) for cy in range(cy0, cy1+1)]
+
+    def _edge_cells(self, key, i):
+        pts = self._pts[key]
+        if len(pts) < 2:
+            return []
+        (x0,y0), (x1,y1) = pts[i], pts[(i+1) % len(pts)]
+        return self._cells(min(x0,x1), min(y0,y1), max(x0,x1), max(y0,y1))
+
+    def _insert_point(self, key, i):
+        self._points[self._cell(*self._pts[key][i])].add((key, i))
+
+    def _delete_point(self, key, i):
+        cell = self._cell(*self._pts[key][i])
+        self._points[cell].discard((key, i))
+        if not self._points[cell]:
+            del self._points[cell]
+
+    def _insert_edge(self, key, i):
+        for cell in self._edge_cells(key, i):
+            self._edges[cell].add((key, i))
+            self._right = max(self._right, cell[0])
+
+    def _delete_edge(self, key, i):
+        for cell in self._edge_cells(key, i):
+            self._edges[cell].discard((key, i))
+            if not self._edges[cell]:
+                del self._edges[cell]
@@ -0,0 +1,37 @@
+import json
+import cv2
+import numpy as np
+from batch import load_manifest, run_batch
+from engine import RecursionEngine
+
+WINDOW = [[20,15],[70,18],[66,50],[24,46]]
+
+def test_run_batch_counts_failed_jobs(tmp_path):
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (64,96,3), dtype=np.uint8), (0,0), 2)
+    mask = np.full(image.shape[:2], 255, dtype=np.uint8)
+    mask[30:40, 40:50] = 0
+    cv2.imwrite(str(tmp_path / "in.png"), image)
+    cv2.imwrite(str(tmp_path / "mask.png"), mask)
+    jobs = [
+        {"input": str(tmp_path / "in.png"), "output": str(tmp_path / "plain.png"), "window": WINDOW},
+        {"input": str(tmp_path / "in.png"), "output": str(tmp_path / "masked.png"), "window": WINDOW,
+         "mask": str(tmp_path / "mask.png"), "depth": "auto", "method": "nested"},
+        {"input": str(tmp_path / "missing.png"), "output": str(tmp_path / "missing_out.png"), "window": WINDOW},
+    ]
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text("\n".join(json.dumps(job) for job in jobs) + "\n")
+
+    seen = []
+    results, summary = run_batch(load_manifest(str(manifest)), processes=2, callback=seen.append)
+    assert summary["jobs"] == 3 and summary["failed"] == 1
+    assert len(seen) == 3
+    failed = [res for res in results if not res["ok"]]
+    assert len(failed) == 1 and failed[0]["input"].endswith("missing.png")
+    assert "Could not read image" in failed[0]["error"]
+    assert not (tmp_path / "missing_out.png").exists()
+
+    expected = RecursionEngine(image).render(WINDOW)
+    assert np.array_equal(cv2.imread(str(tmp_path / "plain.png")), expected)
+    expected = RecursionEngine(image, mask).render(WINDOW, "auto", "nested")
+    assert np.array_equal(cv2.imread(str(tmp_path / "masked.png")), expected)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from cache import RenderCache
+
+def block(nbytes, value=0):
+    return np.full(nbytes, value, dtype=np.uint8)
+
+def test_evicts_least_recently_used():
+    cache = RenderCache(max_bytes=300)
+    cache.put("a", block(100, 1))
+    cache.put("b", block(100, 2))
+    cache.put("c", block(100, 3))
+    assert cache.get("a") is not None     # a is now the most recently used
+    cache.put("d", block(100, 4))
+    assert "b" not in cache
+    assert all(key in cache for key in "acd")
+    assert cache.nbytes == 300
+    assert cache.stats()["evictions"] == 1
+
+def test_replacing_a_key_keeps_the_size():
+    cache = RenderCache(max_bytes=300)
+    cache.put("a", block(100))
+    cache.put("a", block(200))
+    assert len(cache) == 1
+    assert cache.nbytes == 200
+
+def test_oversized_arrays_are_not_kept():
+    cache = RenderCache(max_bytes=100)
+    cache.put("a", block(50))
+    cache.put("big", block(101))
+    assert "big" not in cache
+    assert "a" in cache
+
+def test_cached_arrays_are_read_only():
+    cache = RenderCache()
+    cache.put("a", block(10))
+    with pytest.raises(ValueError):
+        cache.get("a")[0] = 1
+
+def test_stats():
+    cache = RenderCache()
+    cache.put("a", block(10))
+    cache.get("a")
+    cache.get("missing")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+def test_content_hash():
+    a = np.arange(12, dtype=np.uint8).reshape(3,4)
+    assert RenderCache.content_hash(a) == RenderCache.content_hash(a.copy())
+    assert RenderCache.content_hash(a) != RenderCache.content_hash(a.reshape(4,3))
+    # non-contiguous views hash by contents
+    assert RenderCache.content_hash(a[:, ::2]) == RenderCache.content_hash(a[:, ::2].copy())
+
+def test_engine_renders_are_keyed_by_image_quad_mask_and_depth():
+    from engine import RecursionEngine
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (60,80,3), dtype=np.uint8)
+    quad = [(20,15),(60,18),(58,45),(22,42)]
+    cache = RenderCache()
+    engine = RecursionEngine(image, None, cache)
+    first = engine.render(quad, 3)
+    assert engine.render(quad, 3) is first
+    # corners within QUANTUM of each other share the render
+    nudged = [(x + RecursionEngine.QUANTUM/4, y) for x, y in quad]
+    assert engine.render(nudged, 3) is first
+    assert engine.render(quad, 4) is not first
+    assert engine.render([(x+1, y) for x, y in quad], 3) is not first
+    mask = np.full(image.shape[:2], 255, dtype=np.uint8)
+    mask[30:35, 30:40] = 0
+    masked = RecursionEngine(image, mask, cache)
+    assert masked.render(quad, 3) is not first
+    # another engine on the same image shares the cached frame by content
+    assert RecursionEngine(image.copy(), None, cache).render(quad, 3) is first
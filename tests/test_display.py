@@ -0,0 +1,24 @@
+import cv2
+import numpy as np
+import pytest
+from display import TkDisplay
+
+class Photo:
+    """ stands in for the PhotoImage, which needs a Tk root """
+    def paste(self, image):
+        self.pasted = image
+
+@pytest.mark.parametrize("size", [(100,70), (320,240), (333,101)])
+def test_patch_matches_full_scale(size):
+    rng = np.random.default_rng(2)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (180,240,3), dtype=np.uint8), (0,0), 1)
+    display = TkDisplay(size)
+    display._photo = Photo()
+    display.show(frame)
+    for i in range(10):
+        x, y = int(rng.integers(0, 230)), int(rng.integers(0, 170))
+        w, h = int(rng.integers(1, 240-x+1)), int(rng.integers(1, 180-y+1))
+        frame[y:y+h, x:x+w] = rng.integers(0, 256, (h,w,3), dtype=np.uint8)
+        display.patch(frame, (x,y,w,h))
+        full = cv2.cvtColor(cv2.resize(frame, size), cv2.COLOR_BGR2RGB)
+        assert np.array_equal(np.asarray(display._image), full)
@@ -0,0 +1,236 @@
+import cv2
+import numpy as np
+import pytest
+from engine import RecursionEngine
+from raster import ShapeRaster
+from cache import RenderCache
+
+QUAD = [[60,45],[180,50],[175,135],[65,130]]
+DEPTH = 5
+
+@pytest.fixture
+def image():
+    """ smooth gradients with blurred noise, so resampling differences stay small """
+    h,w = 180,240
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, w)[None]
+    y = np.linspace(0, 255, h)[:,None]
+    image = np.dstack([x+0*y, 0*x+y, (x+y)/2]).astype(np.uint8)
+    noise = rng.integers(0, 64, (h,w,3), dtype=np.uint8)
+    return cv2.add(image, cv2.GaussianBlur(noise, (0,0), 3))
+
+def hard_mask(image):
+    mask = np.full(image.shape[:2], 255, dtype=np.uint8)
+    mask[80:100, 100:140] = 0
+    return mask
+
+def interior(engine, dst, depth, mask_rect=None):
+    """
+    returns the pixels away from the nested window (and mask) edges, where the
+    methods only differ by resampling
+    """
+    r,c = engine.imheight, engine.imwidth
+    hom = engine.homography(dst)
+    edges = np.zeros((r,c), dtype=np.uint8)
+    shapes = [np.array([(0,0),(c,0),(c,r),(0,r)], dtype=np.float64)]
+    if mask_rect is not None:
+        x,y,w,h = mask_rect
+        shapes.append(np.array([(x,y),(x+w,y),(x+w,y+h),(x,y+h)], dtype=np.float64))
+    for hk in RecursionEngine.homography_powers(hom, depth)[1:]:
+        for shape in shapes:
+            pts = cv2.perspectiveTransform(shape[None], hk)[0]
+            cv2.polylines(edges, [np.int32(np.round(pts))], True, 255, 5)
+    return edges == 0
+
+@pytest.mark.parametrize("method", ["iterative", "full", "nested"])
+@pytest.mark.parametrize("masked", [False, True])
+def test_methods_match_remap(image, method, masked):
+    mask = hard_mask(image) if masked else None
+    engine = RecursionEngine(image, mask)
+    keep = interior(engine, QUAD, DEPTH, (100,80,40,20) if masked else None)
+    ref = engine.render(QUAD, DEPTH, "remap")
+    draw = engine.render(QUAD, DEPTH, method)
+    diff = np.abs(draw.astype(int) - ref).max(axis=2)[keep]
+    assert diff.mean() < 0.1
+    assert diff.max() <= 4
+
+@pytest.mark.parametrize("interpolation", list(RecursionEngine.INTERPOLATIONS))
+def test_interpolations(image, interpolation):
+    engine = RecursionEngine(image, hard_mask(image), RenderCache(), interpolation=interpolation)
+    ref = engine.render(QUAD, DEPTH, "remap")
+    # tiles only read the source around their own samples, as far as the kernel reaches
+    r,c = image.shape[:2]
+    tiles = np.zeros_like(image)
+    for y in range(0, r, 32):
+        for x in range(0, c, 32):
+            w, h = min(32, c-x), min(32, r-y)
+            tiles[y:y+h, x:x+w] = engine.render_tile(QUAD, DEPTH, (x,y,w,h))
+    assert np.array_equal(tiles, ref)
+    keep = interior(engine, QUAD, DEPTH, (100,80,40,20))
+    for method in ("iterative", "full", "nested"):
+        diff = np.abs(engine.render(QUAD, DEPTH, method).astype(int) - ref).max(axis=2)[keep]
+        assert diff.mean() < 0.1
+        assert diff.max() <= 6
+    # renders are only shared by the cache between engines sampling the same way
+    linear = RecursionEngine(image, hard_mask(image), engine.cache).render(QUAD, DEPTH, "remap")
+    assert (linear is ref) == (interpolation == "linear")
+    with pytest.raises(ValueError):
+        engine.set_interpolation("area")
+
+def test_inside_quad_grid_matches_inside_quad():
+    rng = np.random.default_rng(3)
+    xs, ys = np.arange(-3, 55), np.arange(-2, 52)
+    y, x = np.meshgrid(ys, xs, indexing="ij")
+    # axis aligned integer quads put grid points exactly on their edges
+    quads = [np.array([(2,3),(40,3),(40,30),(2,30)], dtype=np.float64)] + \
+            [rng.uniform(0, 50, (4,2)) for _ in range(50)]
+    for quad in quads + [quad[::-1] for quad in quads]:
+        want = RecursionEngine.inside_quad(quad, x.ravel(), y.ravel()).reshape(x.shape)
+        assert np.array_equal(RecursionEngine.inside_quad_grid(quad, xs, ys), want)
+
+@pytest.mark.parametrize("corner", ["sharp", "hermite"])
+def test_level_tables_outside_window_are_identity(image, corner):
+    engine = RecursionEngine(image, hard_mask(image))
+    r,c = image.shape[:2]
+    x,y,w,h = RecursionEngine.bounding_rect(engine.window_outline(QUAD, corner), (c,r))
+    mapx, mapy, level = engine.level_tables(QUAD, DEPTH, corner=corner)
+    outside = np.ones((r,c), dtype=bool)
+    outside[y:y+h, x:x+w] = False
+    assert (level[outside] == 0).all()
+    gy, gx = np.mgrid[0:r, 0:c]
+    assert np.array_equal(mapx[outside], gx[outside]) and np.array_equal(mapy[outside], gy[outside])
+    # a rect straddling the box edge gets the same tables as the whole frame
+    rect = (x-20, y+10, 60, 50)
+    sub = (slice(rect[1], rect[1]+rect[3]), slice(rect[0], rect[0]+rect[2]))
+    part = engine.level_tables(QUAD, DEPTH, corner=corner, rect=rect, exact=False)
+    for table, whole in zip(part, (mapx, mapy, level)):
+        assert np.array_equal(table, whole[sub])
+
+def test_mask_hides_nested_copy(image):
+    plain = RecursionEngine(image).render(QUAD, DEPTH, "remap")
+    masked = RecursionEngine(image, hard_mask(image)).render(QUAD, DEPTH, "remap")
+    # outside the window the mask changes nothing, inside it blacks out part of the copy
+    assert np.array_equal(plain[:40], masked[:40])
+    assert (masked.max(axis=2) == 0).sum() > (plain.max(axis=2) == 0).sum()
+
+def test_outside_window_is_source(image):
+    engine = RecursionEngine(image)
+    for method in RecursionEngine.METHODS:
+        draw = engine.render(QUAD, DEPTH, method)
+        assert np.array_equal(draw[:40], image[:40]), method
+
+def test_invalid_method(image):
+    with pytest.raises(ValueError):
+        RecursionEngine(image).render(QUAD, DEPTH, "bogus")
+
+def test_mask_shape_mismatch(image):
+    with pytest.raises(ValueError):
+        RecursionEngine(image, np.zeros((10,10), dtype=np.uint8))
+
+@pytest.mark.parametrize("method", RecursionEngine.METHODS)
+@pytest.mark.parametrize("corner", ["sharp", "hermite"])
+def test_depth_zero_is_source(image, method, corner):
+    # the nested method used to index past its list of nested quads at depth 0
+    draw = RecursionEngine(image).render(QUAD, 0, method, corner=corner)
+    assert np.array_equal(draw, image)
+
+def test_with_mask_leaves_original(image):
+    # the editor swaps in clones while the render worker may still use the original
+    engine = RecursionEngine(image)
+    before = engine.render_dirty(QUAD, DEPTH)[0].copy()
+    masked = engine.with_mask(hard_mask(image))
+    assert masked.image is engine.image and masked.masked and not engine.masked
+    assert np.array_equal(engine.render(QUAD, DEPTH), before)
+    assert np.array_equal(masked.render(QUAD, DEPTH), RecursionEngine(image, hard_mask(image)).render(QUAD, DEPTH))
+    patch, rect = masked.render_dirty(QUAD, DEPTH)
+    assert rect == (0, 0, engine.imwidth, engine.imheight)
+
+def test_set_image_keeps_mask(image):
+    engine = RecursionEngine(image, hard_mask(image))
+    mask = engine.mask
+    engine.set_image(255 - image, keep_mask=True)
+    assert engine.mask is mask and engine.masked
+    assert np.array_equal(engine.render(QUAD, DEPTH),
+                          RecursionEngine(255 - image, hard_mask(image)).render(QUAD, DEPTH))
+    with pytest.raises(ValueError):
+        engine.set_image(image[:100], keep_mask=True)
+
+@pytest.mark.parametrize("method", RecursionEngine.METHODS)
+def test_curved_window_is_covered(image, method):
+    # the hermite outline bulges past the quad, the nested copy must still fill it
+    engine = RecursionEngine(cv2.add(image, 16))
+    draw = engine.render(QUAD, DEPTH, method, corner="hermite")
+    outline = engine.window_outline(QUAD, "hermite")
+    window = cv2.fillPoly(np.zeros(image.shape[:2], dtype=np.uint8), [np.int32(np.round(outline))], 255)
+    window = cv2.erode(window, np.ones((5,5), dtype=np.uint8))
+    # the edges of the nested frames sample the black border, as with any corner
+    r,c = engine.imheight, engine.imwidth
+    frame = np.array([[(0,0),(c,0),(c,r),(0,r)]], dtype=np.float64)
+    for hk in RecursionEngine.homography_powers(engine.homography(QUAD, "hermite"), DEPTH)[1:]:
+        pts = cv2.perspectiveTransform(frame, hk)[0]
+        cv2.polylines(window, [np.int32(np.round(pts))], True, 0, 5)
+    assert not np.any(draw[window > 0].max(axis=1) == 0)
+
+def test_enclosing_quad():
+    quad = np.array(QUAD, dtype=np.float64)
+    for pts in (quad, quad[::-1]):
+        outline = RecursionEngine.enclosing_quad(pts, ShapeRaster.outline(pts, "hermite"))
+        enclosed = ShapeRaster.outline(pts, "hermite")
+        assert all(cv2.pointPolygonTest(np.float32(outline), tuple(map(float, p)), True) >= -1e-6 for p in enclosed)
+        # bezier outlines stay inside a convex quad, which is kept as it is
+        assert np.allclose(RecursionEngine.enclosing_quad(pts, ShapeRaster.outline(pts, "bezier")), pts)
+
+def test_mask_flags(monkeypatch):
+    monkeypatch.setattr(RecursionEngine, "MASK_CHUNK", 64)
+    mask = np.full((50,40), 255, dtype=np.uint8)
+    assert RecursionEngine.mask_flags(mask) == (False, False)
+    mask[45, 5] = 0
+    assert RecursionEngine.mask_flags(mask) == (True, False)
+    mask[2, 30] = 128
+    assert RecursionEngine.mask_flags(mask) == (True, True)
+
+def test_with_mask_patches_uploaded_mask(image):
+    soft = cv2.GaussianBlur(hard_mask(image), (0,0), 2)
+    engine = RecursionEngine(image, soft)
+    engine.device("mask")
+    moved = np.roll(soft, 10, axis=1)
+    clone = engine.with_mask(moved, rect=(90,70,70,40))
+    assert np.array_equal(clone.device("mask").get(), RecursionEngine(image, moved).device("mask").get())
+    assert np.array_equal(engine.device("mask").get(), RecursionEngine(image, soft).device("mask").get())
+
+def test_mip_sample_is_centred():
+    # on a ramp every level must give back the source coordinate it is sampled at,
+    # to within the 1/32 pixel grid some opencv versions quantize remap maps to
+    ramp = np.tile(np.arange(256, dtype=np.uint8), (64,1))
+    engine = RecursionEngine(ramp)
+    x = np.linspace(16, 239, 50)
+    for m in range(len(engine.mip_pyramid())):
+        if engine.mip_pyramid()[m].shape[1] < 16:
+            break
+        assert np.allclose(engine.mip_sample(m, x, np.full_like(x, 32)).ravel(), x, rtol=0, atol=2**m/32)
+
+@pytest.mark.parametrize("mask", ["none", "hard", "soft"])
+@pytest.mark.parametrize("cached", [False, True])
+def test_render_dirty_matches_render(image, mask, cached):
+    # patching every returned rect into the first frame must give the whole render
+    rng = np.random.default_rng(1)
+    masks = {"none": None, "hard": hard_mask(image), "soft": cv2.GaussianBlur(hard_mask(image), (0,0), 3)}
+    engine = RecursionEngine(image, masks[mask], RenderCache() if cached else None)
+    ref = RecursionEngine(image, masks[mask])
+    r,c = image.shape[:2]
+    quad = np.array(QUAD, dtype=np.float64)
+    frame, method, corner = None, "iterative", "sharp"
+    for step in range(30):
+        if step % 5 == 0:
+            method = rng.choice(RecursionEngine.METHODS)
+        if step % 7 == 0:
+            corner = rng.choice(["sharp", "bezier", "hermite"])
+        quad[rng.integers(4)] += rng.normal(0, 6, 2)
+        if step == 15:
+            quad[0] = (-20, -15)    # a corner off the frame
+        patch, (x,y,w,h) = engine.render_dirty(quad.tolist(), DEPTH, method, corner=corner)
+        if (x,y,w,h) == (0,0,c,r):
+            frame = np.array(patch)
+        else:
+            frame[y:y+h, x:x+w] = patch
+        assert np.array_equal(frame, ref.render(quad.tolist(), DEPTH, method, corner=corner)), (step, method, corner)
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+from PIL import Image
+from fileio import ImageIO
+
+def test_read_mask_keeps_any_channel(tmp_path):
+    mask = np.zeros((20,30,3), dtype=np.uint8)
+    mask[:, 10:] = (0,0,255)    # pure red has almost no luma
+    mask[:, 20:] = 255
+    path = str(tmp_path / "mask.png")
+    cv2.imwrite(path, mask)
+    read = ImageIO.read_mask(path)
+    assert read.shape == (20,30)
+    assert np.array_equal(read, mask.max(axis=2))
+
+def test_read_mask_grayscale(tmp_path):
+    mask = np.tile(np.arange(30, dtype=np.uint8)*8, (20,1))
+    path = str(tmp_path / "mask.png")
+    cv2.imwrite(path, mask)
+    assert np.array_equal(ImageIO.read_mask(path), mask)
+
+def test_read_mask_missing(tmp_path):
+    assert ImageIO.read_mask(str(tmp_path / "missing.png")) is None
+
+def results(io, count):
+    return [io.results.get(timeout=10) for _ in range(count)]
+
+def test_load_past_decompression_bomb_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    path = str(tmp_path / "big.jpg")
+    cv2.imwrite(path, np.full((200,300,3), 128, dtype=np.uint8))
+    io = ImageIO()
+    io.load(path, preview_size=16)
+    (kind, _, image), = results(io, 1)
+    assert kind == "image" and image.shape == (200,300,3)
+
+def test_failed_job_keeps_the_thread(tmp_path, monkeypatch):
+    def fail(path, preview_size):
+        raise RuntimeError("unexpected")
+    monkeypatch.setattr(ImageIO, "preview_reduction", staticmethod(fail))
+    io = ImageIO()
+    io.load(str(tmp_path / "any.jpg"))
+    io.save(str(tmp_path / "out.png"), np.zeros((4,4,3), dtype=np.uint8))
+    assert results(io, 2) == [("image", str(tmp_path / "any.jpg"), None), ("saved", str(tmp_path / "out.png"), None)]
@@ -0,0 +1,40 @@
+import numpy as np
+from masks import MaskLayer
+from polygon import Polygon
+
+SIZE = (200,150)
+
+def elements(dx=0):
+    return [Polygon([(20+dx,20),(70+dx,25),(60,80)]), Polygon([(120,90),(180,90),(180,140),(120,140)])]
+
+def composed(polys):
+    layer = MaskLayer()
+    layer.sync(polys, SIZE)
+    return layer
+
+def test_moving_an_element_recomposes_its_rect():
+    layer = composed(elements())
+    before = layer.alpha
+    rect = layer.sync(elements(dx=10), SIZE)
+    x,y,w,h = rect
+    assert 0 < w*h < SIZE[0]*SIZE[1]
+    assert np.array_equal(layer.alpha, composed(elements(dx=10)).alpha)
+    # the old array is replaced, not changed, and only differs inside rect
+    assert layer.alpha is not before
+    assert np.array_equal(before, composed(elements()).alpha)
+    outside = np.ones(SIZE[::-1], dtype=bool)
+    outside[y:y+h, x:x+w] = False
+    assert np.array_equal(before[outside], layer.alpha[outside])
+
+def test_unchanged_elements_do_nothing():
+    layer = composed(elements())
+    before = layer.alpha
+    assert layer.sync(elements(), SIZE)[2:] == (0,0)
+    assert layer.alpha is before
+
+def test_flags_and_key():
+    layer = composed(elements())
+    assert layer.flags() == (True, True)
+    assert composed([]).flags() == (False, False)
+    assert layer.key() == composed(elements()).key()
+    assert layer.key() != composed(elements(dx=1)).key()
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from polygon import Polygon
+
+PTS = [(1,1), (2,5), (7,2), (12,3), (15,7), (20,4)]
+
+def test_bezier_matches_scalar():
+    poly = Polygon(PTS)
+    curve = poly.render_array("bezier")
+    numsegs = (len(PTS)+1)*Polygon.NUM_INTERP_SEGS
+    ctrl = [np.array(p, dtype=np.float64) for p in PTS]
+    want = np.array([Polygon.bezier(ctrl, t) for t in np.linspace(0, 1, numsegs+1)])
+    np.testing.assert_allclose(curve, want, atol=1e-9)
+
+def test_hermite_matches_scalar():
+    poly = Polygon(PTS)
+    curve = poly.render_array("hermite")
+    p = [np.array(pt, dtype=np.float64) for pt in PTS]
+    t = np.linspace(0, 1, Polygon.NUM_INTERP_SEGS+1)
+    want = [Polygon.hermite(p, tk, k) for k in range(len(p)-1) for tk in t[:-1]] + [p[-1]]
+    np.testing.assert_allclose(curve, np.array(want), atol=1e-9)
+
+def test_render_matches_render_array():
+    poly = Polygon(PTS)
+    for corner in ("sharp", "bezier", "hermite"):
+        x, y = poly.render(corner)
+        np.testing.assert_allclose(np.column_stack([x, y]), poly.render_array(corner))
+    with pytest.raises(ValueError):
+        poly.render("bogus")
+
+def test_closed_hermite_passes_through_points():
+    poly = Polygon(PTS[:4])
+    curve = poly.render_array("hermite", closed=True)
+    assert len(curve) == 4*Polygon.NUM_INTERP_SEGS
+    np.testing.assert_allclose(curve[::Polygon.NUM_INTERP_SEGS], poly.pts)
+
+def test_points_grow_in_place():
+    poly = Polygon()
+    for i in range(9):
+        poly.add(i, 2*i)
+    assert len(poly) == 9
+    assert poly[8] == (8.0, 16.0)
+    poly.move(0, 1, 1)
+    assert poly[0] == (1.0, 1.0)
+
+def test_high_degree_bezier_stays_finite():
+    # the scalar form overflows its binomials long before this, the log space basis must not
+    rng = np.random.default_rng(0)
+    pts = rng.uniform(0, 100, (1200, 2))
+    curve = Polygon(pts).render_array("bezier")
+    assert np.isfinite(curve).all()
+    np.testing.assert_allclose(curve[[0, -1]], pts[[0, -1]])
+    basis = Polygon.bernstein_matrix(len(pts)-1, 50)
+    np.testing.assert_allclose(basis.sum(axis=1), 1)
+    # and agrees with the scalar form wherever that still works
+    pts = pts[:40]
+    numsegs = (len(pts)+1)*Polygon.NUM_INTERP_SEGS
+    want = np.array([Polygon.bezier(list(pts), t) for t in np.linspace(0, 1, numsegs+1)])
+    np.testing.assert_allclose(Polygon(pts).render_array("bezier"), want, rtol=1e-9, atol=1e-9)
+
+def test_transform_all_matches_per_polygon_transforms():
+    rng = np.random.default_rng(1)
+    polys = [Polygon(rng.uniform(0, 100, (n, 2))) for n in (3, 0, 7, 4)]
+    affine = [[1.5, 0.2, 3], [-0.1, 0.8, -7]]
+    hom = [[1.1, 0.1, 5], [0.05, 0.9, -2], [1e-3, -2e-3, 1]]
+    for mat, one in ((affine, Polygon.affine), (hom, Polygon.homography)):
+        want = [one(p.copy(), mat).pts for p in polys]
+        bufs = [p._buf for p in polys]
+        Polygon.transform_all(polys, mat)
+        for p, w, buf in zip(polys, want, bufs):
+            np.testing.assert_allclose(p.pts, w)
+            assert p._buf is buf    # transformed in place
+    poly = Polygon([(1,2), (3,4)])
+    assert poly.translate(1, -1).scale(2, 3) is poly
+    np.testing.assert_allclose(poly.pts, [(4,3), (8,9)])
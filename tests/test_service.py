@@ -0,0 +1,70 @@
+import json
+import queue
+import threading
+import http.client
+import cv2
+import numpy as np
+import pytest
+import service
+from service import RenderService, make_server
+
+JOB = {"input": "in.png", "window": [[10,10],[50,12],[48,40],[12,38]]}
+
+@pytest.mark.parametrize("change", [
+    {"depth": 10**9}, {"depth": -1}, {"depth": 2.5}, {"depth": "deep"},
+    {"window": [[0,0],[1,0],[1,1]]}, {"window": [[0,0],[1,0],[1,1],[0,float("nan")]]},
+    {"window": "square"}, {"method": "fast"}, {"corner": "round"}, {"format": "gif"},
+])
+def test_invalid_jobs_are_refused_before_queueing(change):
+    service = RenderService(workers=0, queue_size=1)
+    with pytest.raises(ValueError):
+        service.submit(dict(JOB, **change))
+    assert service.metrics()["queue"]["depth"] == 0
+    service.submit(dict(JOB, depth="auto"))
+
+def post(server, job):
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        conn.request("POST", "/render", json.dumps(job))
+        response = conn.getresponse()
+        return response.status, response.getheader("Retry-After"), response.read()
+    finally:
+        conn.close()
+
+def test_full_queue_answers_503():
+    render = RenderService(workers=0, queue_size=1)
+    render.submit(JOB)
+    with pytest.raises(queue.Full):
+        render.submit(JOB)
+    server = make_server(render, port=0, timeout=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, retry, _ = post(server, JOB)
+        assert status == 503 and retry is not None
+        status, _, body = post(server, dict(JOB, depth=-1))
+        assert status == 400 and b"Depth" in body
+        assert render.metrics()["requests"]["rejected"] == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_concurrent_misses_share_one_decode(tmp_path, monkeypatch):
+    cv2.imwrite(str(tmp_path / "in.png"), np.zeros((20,30,3), dtype=np.uint8))
+    reads, imread = [], cv2.imread
+    def slow_imread(path, *args):
+        reads.append(path)
+        threading.Event().wait(0.2)
+        return imread(path, *args)
+    monkeypatch.setattr(service.cv2, "imread", slow_imread)
+    render = RenderService(str(tmp_path), workers=0)
+    engines = []
+    threads = [threading.Thread(target=lambda: engines.append(render.engine("in.png")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(reads) == 1
+    assert len(engines) == 4 and all(engine is engines[0] for engine in engines)
+    assert (render.engine_hits, render.engine_misses) == (3, 1)
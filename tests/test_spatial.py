@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from polygon import Polygon
+from spatial import PointIndex
+
+def brute_nearest(polys, x, y, r, keys=None):
+    best, best_d = None, r*r
+    for key, poly in polys.items():
+        if keys is not None and key not in keys:
+            continue
+        for i, (px, py) in enumerate(poly):
+            d = (px-x)**2 + (py-y)**2
+            if d <= best_d:
+                best, best_d = (key, i), d
+    return best
+
+def brute_contains(poly, x, y):
+    pts = poly.pts
+    inside = False
+    for i in range(len(pts)):
+        (x0,y0), (x1,y1) = pts[i], pts[(i+1) % len(pts)]
+        if (y0 > y) != (y1 > y) and x < x0 + (y-y0)*(x1-x0)/(y1-y0):
+            inside = not inside
+    return inside
+
+@pytest.fixture
+def polys():
+    return {
+        "window": Polygon([(50,40),(170,40),(170,120),(50,120)]),
+        ("mask", 0): Polygon([(10,10),(60,15),(30,30),(70,70),(5,60)]),   # concave
+        ("mask", 1): Polygon([(100,60),(200,80),(140,150)]),
+    }
+
+def make_index(polys):
+    index = PointIndex(cell=16)
+    for key, poly in polys.items():
+        index.add(key, poly)
+    return index
+
+def test_nearest(polys):
+    index = make_index(polys)
+    assert index.nearest(52, 43, 6) == ("window", 0)
+    assert index.nearest(52, 43, 6, keys=[("mask", 0)]) is None
+    assert index.nearest(0, 200, 6) is None
+    rng = np.random.default_rng(0)
+    for x, y in rng.uniform(0, 220, (300, 2)):
+        assert index.nearest(x, y, 12) == brute_nearest(polys, x, y, 12)
+
+def test_nearest_after_move(polys):
+    index = make_index(polys)
+    polys["window"].move(2, 40, 40)
+    index.update("window", 2)
+    assert index.nearest(170, 120, 6) is None
+    assert index.nearest(210, 160, 6) == ("window", 2)
+
+def test_containing(polys):
+    index = make_index(polys)
+    rng = np.random.default_rng(1)
+    for x, y in rng.uniform(0, 220, (500, 2)):
+        want = {key for key, poly in polys.items() if brute_contains(poly, x, y)}
+        assert set(index.containing(x, y)) == want
+
+def test_remove_and_rebuild(polys):
+    index = make_index(polys)
+    index.remove(("mask", 1))
+    assert ("mask", 1) not in index
+    assert index.nearest(140, 150, 6) is None
+    Polygon.transform_all(list(polys.values()), [[2,0,0],[0,2,0]])
+    index.rebuild()
+    assert index.nearest(100, 80, 6) == ("window", 0)
+
+def test_incremental_updates_match_a_fresh_index(polys):
+    # a long drag of single points, across cells and past the origin, must leave
+    # the same grid as indexing the moved polygons from scratch
+    index = make_index(polys)
+    rng = np.random.default_rng(2)
+    keys = list(polys)
+    for step in range(200):
+        key = keys[rng.integers(len(keys))]
+        i = int(rng.integers(len(polys[key])))
+        polys[key].move(i, *rng.uniform(-20, 20, 2))
+        index.update(key, i)
+        if step % 20 == 0:
+            x, y = rng.uniform(-40, 240, 2)
+            assert index.nearest(x, y, 12) == brute_nearest(polys, x, y, 12)
+            assert set(index.containing(x, y)) == {key for key, poly in polys.items()
+                                                   if brute_contains(poly, x, y)}
+    fresh = make_index(polys)
+    assert dict(index._points) == dict(fresh._points)
+    assert dict(index._edges) == dict(fresh._edges)
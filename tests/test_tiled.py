@@ -0,0 +1,37 @@
+import cv2
+import numpy as np
+import pytest
+from engine import RecursionEngine
+from tiled import TiledRenderer, open_source, render_tiled
+
+WINDOW = [(40,30),(120,38),(112,90),(46,84)]
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(0)
+    return cv2.GaussianBlur(rng.integers(0, 256, (110,150,3), dtype=np.uint8), (0,0), 1.5)
+
+@pytest.mark.parametrize("masked", [False, True])
+def test_tiles_match_render_remap(image, masked):
+    mask = None
+    if masked:
+        mask = np.full(image.shape[:2], 255, dtype=np.uint8)
+        mask[50:70, 60:90] = 0
+    renderer = TiledRenderer(image, WINDOW, mask, depth=5, tile=32)
+    # tiles that do not divide the image leave ragged ones along the right and bottom
+    assert len(renderer.tiles()) == 5*4
+    out = renderer.render(np.zeros_like(image))
+    assert np.array_equal(out, RecursionEngine(image, mask).render_remap(WINDOW, 5))
+
+def test_render_tiled_through_memory_maps(image, tmp_path):
+    cv2.imwrite(str(tmp_path / "in.png"), image)
+    done = []
+    stats = render_tiled(str(tmp_path / "in.png"), str(tmp_path / "out.npy"), WINDOW, depth="auto",
+                         tile=48, callback=lambda n, total: done.append((n, total)))
+    assert done[-1] == (stats["tiles"], stats["tiles"]) == (12, 12)
+    assert (tmp_path / "in.png.npy").exists()
+    source = open_source(str(tmp_path / "in.png"))
+    assert isinstance(source, np.memmap) and np.array_equal(source, image)
+    engine = RecursionEngine(image)
+    want = engine.render_remap(WINDOW, stats["depth"])
+    assert np.array_equal(np.load(str(tmp_path / "out.npy")), want)
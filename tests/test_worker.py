@@ -0,0 +1,27 @@
+import threading
+from worker import RenderWorker
+
+def test_kept_requests_are_never_dropped():
+    started, gate = threading.Event(), threading.Event()
+    def render(request):
+        started.set()
+        gate.wait()
+        return request
+    worker = RenderWorker(render)
+    try:
+        worker.submit("busy")
+        started.wait(5)
+        # the worker is blocked on "busy", everything below waits
+        for request in ("a", "b", "c"):
+            worker.submit(request)
+        worker.submit("save 1", keep=True)
+        worker.submit("d")
+        worker.submit("save 2", keep=True)
+        gate.set()
+        done = []
+        while len(done) < 4:
+            done.append(worker.results.get(timeout=5)[1])
+        assert done == ["busy", "save 1", "save 2", "d"]
+        assert worker.dropped == 3
+    finally:
+        worker.stop()
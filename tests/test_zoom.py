@@ -0,0 +1,22 @@
+import cv2
+import numpy as np
+from engine import RecursionEngine
+from zoom import ZoomAnimation
+
+WINDOW = [(40,30),(120,36),(116,92),(44,86)]
+
+def test_loop_is_seamless():
+    # the view through H shows the same mirror image, so the last frame is the
+    # first again, up to which side of a nested window edge a pixel rounds to
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (120,160,3), dtype=np.uint8), (0,0), 2)
+    engine = RecursionEngine(image)
+    anim = ZoomAnimation(engine, WINDOW, depth=4, nframes=12)
+    first, last = anim.frame(0), anim.frame(anim.nframes)
+    edges = np.zeros(image.shape[:2], dtype=np.uint8)
+    for quad in RecursionEngine.nested_quads(engine.homography(WINDOW), (160,120), anim.depth):
+        cv2.polylines(edges, [np.int32(np.round(quad))], True, 1, 3)
+    assert np.array_equal(first[edges == 0], last[edges == 0])
+    assert np.abs(first.astype(int) - last).mean() < 1
+    # while the frames in between do zoom
+    assert np.abs(first.astype(int) - anim.frame(anim.nframes//2)).mean() > 10
@@ -0,0 +1,126 @@
+"""
+tiled rendering of infinite mirror images too large to hold in memory
+
+the source (and mask) are read through memory-mapped .npy files, every output
+tile is computed on its own by mapping its pixels back through the composed
+homographies, and tiles are written straight into a memory-mapped .npy output,
+so the memory in use is bounded by the tile size rather than the image size
+
+other input formats have to be decoded in full once, the decoded pixels are
+kept next to the input as <input>.npy so later renders map them directly
+"""
+import os
+import cv2
+import json
+import time, sys
+import argparse
+import numpy as np
+from engine import RecursionEngine
+from fileio import ImageIO
+
+def open_source(path, mask=False):
+    """
+    returns the image at path as a read-only np.memmap, decoding it into
+    <path>.npy first unless path already is a .npy file or was decoded before,
+    a mask is decoded by ImageIO.read_mask into <path>.mask.npy
+    """
+    if not path.endswith(".npy"):
+        cached = path + (".mask.npy" if mask else ".npy")
+        if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(path):
+            image = ImageIO.read_mask(path) if mask else cv2.imread(path)
+            if image is None:
+                raise IOError("Could not read %s: %s" % ("mask" if mask else "image", path))
+            out = np.lib.format.open_memmap(cached + ".part", "w+", image.dtype, image.shape)
+            out[...] = image
+            out.flush()
+            del image, out
+            os.replace(cached + ".part", cached)
+        path = cached
+    return np.load(path, mmap_mode="r")
+
+class TiledRenderer:
+    """
+    The TiledRenderer class renders the remap method tile by tile
+    """
+
+    def __init__(self, image, window, mask=None, depth=4, min_area=1.0, corner="sharp", tile=1024):
+        self.engine = RecursionEngine(image, mask)
+        self.window = window
+        self.corner = corner
+        self.tile = tile        # int - side of the square tiles in pixels
+        if depth == "auto":
+            depth = self.engine.adaptive_depth(self.engine.homography(window, corner), min_area)
+        self.depth = depth
+
+    def tiles(self):
+        """
+        returns the (x,y,w,h) rects of every tile in row-major order
+        """
+        r,c = self.engine.imheight, self.engine.imwidth
+        return [(x, y, min(self.tile, c-x), min(self.tile, r-y))
+                for y in range(0, r, self.tile) for x in range(0, c, self.tile)]
+
+    def render(self, out, callback=None):
+        """
+        renders every tile into out, an array (usually a np.memmap) the size of
+        the image, callback, if given, is called with (tiles done, total tiles)
+        """
+        tiles = self.tiles()
+        for n, (x,y,w,h) in enumerate(tiles):
+            out[y:y+h, x:x+w] = self.engine.render_tile(self.window, self.depth, (x,y,w,h), self.corner)
+            if callback is not None:
+                callback(n+1, len(tiles))
+        return out
+
+def render_tiled(imfile, output, window, depth=4, min_area=1.0, maskfile=None,
+                 corner="sharp", tile=1024, callback=None):
+    """
+    renders imfile into output tile by tile, returns a dict of stats
+
+    a .npy output is written tile by tile through a memory map, any other
+    format is rendered into <output>.npy first and then encoded by cv2.imwrite,
+    which does need the whole output in memory
+    """
+    start = time.perf_counter()
+    image = open_source(imfile)
+    mask = open_source(maskfile, mask=True) if maskfile else None
+    renderer = TiledRenderer(image, window, mask, depth, min_area, corner, tile)
+
+    path = output if output.endswith(".npy") else output + ".npy"
+    out = np.lib.format.open_memmap(path, "w+", image.dtype, image.shape)
+    renderer.render(out, callback)
+    out.flush()
+    if path != output:
+        if not cv2.imwrite(output, out):
+            raise IOError("Could not write image: %s" % output)
+        del out
+        os.remove(path)
+
+    elapsed = time.perf_counter() - start
+    return {"tiles": len(renderer.tiles()), "depth": renderer.depth, "elapsed": elapsed,
+            "megapixels": image.shape[0]*image.shape[1]/1e6}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a large infinite mirror image tile by tile")
+    parser.add_argument("input", help="input image, or a .npy array to map directly")
+    parser.add_argument("output", help="output .npy array written in place, or an image file")
+    parser.add_argument("window", help="window quad in image pixels as json, "
+                                       "e.g. [[100,80],[300,90],[290,250],[110,240]]")
+    parser.add_argument("--mask", help="mask image or .npy array, the same size as the input")
+    parser.add_argument("--depth", default="4", help="recursion depth or \"auto\"")
+    parser.add_argument("--min-area", type=float, default=1.0,
+                        help="smallest window in pixels for --depth auto")
+    parser.add_argument("--corner", default="sharp", help="window corner interpolation")
+    parser.add_argument("--tile", type=int, default=1024, help="tile size in pixels")
+    args = parser.parse_args(argv)
+
+    depth = args.depth if args.depth == "auto" else int(args.depth)
+    progress = lambda n, total: print("\rtile %d/%d" % (n, total), end="", flush=True)
+    stats = render_tiled(args.input, args.output, json.loads(args.window), depth, args.min_area,
+                         args.mask, args.corner, args.tile, progress)
+    print("\n%d tiles, depth %d, %.1f MP in %.2fs" % (stats["tiles"], stats["depth"],
+                                                      stats["megapixels"], stats["elapsed"]))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
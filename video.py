@@ -0,0 +1,220 @@
+"""
+infinite mirror effects on videos and image sequences
+
+the window is keyframed with a json object mapping frame numbers to quads
+given in video pixel coordinates:
+
+    {"0": [[x0,y0],[x1,y1],[x2,y2],[x3,y3]], "90": [[x0,y0],...]}
+
+corners are linearly interpolated between keyframes and held before the first and
+after the last one, the input and output may be anything cv2.VideoCapture and
+cv2.VideoWriter accept, including printf style image sequences like frames/%04d.png
+"""
+import cv2
+import json
+import time, sys
+import bisect
+import argparse
+import threading
+import queue
+import numpy as np
+from polygon import Polygon
+from engine import RecursionEngine
+from fileio import ImageIO
+
+class Keyframes:
+    """
+    The Keyframes class interpolates the window Polygon for any frame from a set of keyframes
+    """
+
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("At least one keyframe is needed")
+        items = sorted((int(frame), poly if isinstance(poly, Polygon) else Polygon(poly))
+                       for frame, poly in keys.items())
+        self.frames = [frame for frame, _ in items]
+        self.polys = [poly for _, poly in items]
+
+    def __getitem__(self, frame):
+        """
+        returns the window Polygon at the given frame
+        """
+        i = bisect.bisect_right(self.frames, frame)
+        if i == 0:
+            return self.polys[0]
+        if i == len(self.frames):
+            return self.polys[-1]
+        f0, f1 = self.frames[i-1], self.frames[i]
+        return Polygon.lerp(self.polys[i-1], self.polys[i], (frame-f0)/(f1-f0))
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return Keyframes(json.load(f))
+
+
+class VideoRenderer:
+    """
+    The VideoRenderer class streams video frames through the recursion engine
+
+    decoding, rendering and encoding run on their own threads connected by bounded
+    queues, so the three stages overlap and memory stays bounded by the queue size
+    frames are rendered with remap tables, which are reused for as long as the
+    window corners move less than tolerance pixels between frames
+    """
+
+    def __init__(self, keyframes, mask=None, depth=4, min_area=1.0, tolerance=0.05, queue_size=8):
+        self.keyframes = keyframes      # Keyframes - window per frame
+        self.mask = mask                # np img - mask applied to every frame, or None
+        self.depth = depth              # int or "auto" - recursion depth
+        self.min_area = min_area        # float - smallest window in pixels for "auto" depth
+        self.tolerance = tolerance      # float - corner motion in pixels below which tables are reused
+        self.queue_size = queue_size    # int - frames buffered between stages
+
+        self._quad = None               # np array - quad the current tables were built for
+        self._tables = None             # (mapx, mapy) - current fixed point remap tables
+        self.stats = {}
+
+    def tables(self, engine, quad):
+        """
+        returns remap tables for quad, rebuilding them only when the quad
+        moved by more than the tolerance since they were last built
+        """
+        quad = np.array(quad, dtype=np.float64)
+        if self._quad is not None and np.abs(quad - self._quad).max() <= self.tolerance:
+            self.stats["reused"] += 1
+            return self._tables
+
+        depth = self.depth
+        if depth == "auto":
+            depth = engine.adaptive_depth(engine.homography(quad), self.min_area)
+        mapx, mapy = engine.remap_tables(quad, depth)
+        self._tables = cv2.convertMaps(mapx, mapy, cv2.CV_16SC2)
+        self._quad = quad
+        self.stats["rebuilt"] += 1
+        return self._tables
+
+    def run(self, src, dst, fourcc="mp4v", fps=None):
+        """
+        render every frame of src into dst, returns a dict of stats
+        """
+        cap = cv2.VideoCapture(src)
+        if not cap.isOpened():
+            raise IOError("Could not open video: %s" % src)
+        fps = fps or cap.get(cv2.CAP_PROP_FPS) or 30.0
+        w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc), fps, (w,h))
+        if not writer.isOpened():
+            cap.release()
+            raise IOError("Could not open video writer: %s" % dst)
+
+        self._quad, self._tables = None, None
+        self.stats = {"frames": 0, "rebuilt": 0, "reused": 0,
+                      "decode": 0.0, "render": 0.0, "encode": 0.0}
+        decoded, rendered = queue.Queue(self.queue_size), queue.Queue(self.queue_size)
+        errors, stop = [], threading.Event()
+        reader = threading.Thread(target=self._read, args=(cap, decoded, errors, stop))
+        encoder = threading.Thread(target=self._write, args=(writer, rendered, errors))
+
+        start = time.perf_counter()
+        reader.start()
+        encoder.start()
+        engine = None
+        try:
+            while True:
+                item = decoded.get()
+                if item is None:
+                    break
+                i, frame = item
+                t0 = time.perf_counter()
+                if engine is None:
+                    engine = RecursionEngine(frame, self.mask)
+                else:
+                    engine.set_image(frame, keep_mask=True)
+                mapx, mapy = self.tables(engine, self.keyframes[i])
+                rendered.put(engine.remap(mapx, mapy))
+                self.stats["render"] += time.perf_counter() - t0
+                self.stats["frames"] += 1
+        finally:
+            rendered.put(None)
+            encoder.join()
+            # unblock the reader if rendering stopped early
+            stop.set()
+            while reader.is_alive():
+                try:
+                    decoded.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+            cap.release()
+            writer.release()
+        if errors:
+            raise errors[0]
+
+        elapsed = time.perf_counter() - start
+        self.stats["elapsed"] = elapsed
+        self.stats["fps"] = self.stats["frames"]/elapsed if elapsed else 0.0
+        return self.stats
+
+    def _read(self, cap, decoded, errors, stop):
+        try:
+            i = 0
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                ok, frame = cap.read()
+                self.stats["decode"] += time.perf_counter() - t0
+                if not ok:
+                    break
+                decoded.put((i, frame))
+                i += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            decoded.put(None)
+
+    def _write(self, writer, rendered, errors):
+        try:
+            while True:
+                frame = rendered.get()
+                if frame is None:
+                    break
+                t0 = time.perf_counter()
+                writer.write(frame)
+                self.stats["encode"] += time.perf_counter() - t0
+        except Exception as e:
+            errors.append(e)
+            # keep draining so the render loop never blocks on a full queue
+            while rendered.get() is not None:
+                pass
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render an infinite mirror video")
+    parser.add_argument("input", help="input video or printf style image sequence")
+    parser.add_argument("output", help="output video or printf style image sequence")
+    parser.add_argument("keyframes", help="json file mapping frame numbers to window quads")
+    parser.add_argument("--mask", help="mask image, the same size as the video")
+    parser.add_argument("--depth", default="4", help="recursion depth or \"auto\"")
+    parser.add_argument("--min-area", type=float, default=1.0,
+                        help="smallest window in pixels for --depth auto")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="corner motion in pixels below which remap tables are reused")
+    parser.add_argument("--fourcc", default="mp4v", help="output codec")
+    parser.add_argument("--fps", type=float, help="output frame rate (default: input's)")
+    args = parser.parse_args(argv)
+
+    mask = None
+    if args.mask:
+        mask = ImageIO.read_mask(args.mask)
+        if mask is None:
+            raise IOError("Could not read mask: %s" % args.mask)
+    depth = args.depth if args.depth == "auto" else int(args.depth)
+    renderer = VideoRenderer(Keyframes.load(args.keyframes), mask, depth,
+                             args.min_area, args.tolerance)
+    stats = renderer.run(args.input, args.output, args.fourcc, args.fps)
+    print("%d frames in %.2fs (%.1f fps), remap tables rebuilt %d times, reused %d times"
+          % (stats["frames"], stats["elapsed"], stats["fps"], stats["rebuilt"], stats["reused"]))
+    print("decode %.2fs, render %.2fs, encode %.2fs" % (stats["decode"], stats["render"], stats["encode"]))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
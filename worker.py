@@ -0,0 +1,95 @@
+import time
+import queue
+import threading
+import collections
+
+class RenderWorker:
+    """
+    The RenderWorker class runs renders on a background thread so the caller never blocks
+
+    only the newest request is kept: submitting while another request is still
+    waiting replaces (drops) the waiting one, and finished frames are handed
+    back through the results queue as (request, result, seconds)
+
+    requests submitted with keep, such as renders to be saved, are never dropped
+    and run in order ahead of the newest request
+    """
+
+    def __init__(self, render):
+        self.render = render            # callable - request -> result
+        self.results = queue.Queue()    # finished (request, result, seconds)
+
+        self.frames = 0                 # int - number of finished renders
+        self.dropped = 0                # int - number of requests replaced before starting
+        self.frame_time = 0.0           # float - seconds taken by the last render
+        self.total_time = 0.0           # float - seconds taken by all renders
+
+        self._pending = None
+        self._kept = collections.deque()
+        self._busy = False
+        self._running = True
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, request, keep=False):
+        """
+        queue request to be rendered next, replacing any request still waiting
+        unless keep is set, which queues it behind the other kept requests instead
+        """
+        with self._cond:
+            if keep:
+                self._kept.append(request)
+            else:
+                if self._pending is not None:
+                    self.dropped += 1
+                self._pending = request
+            self._cond.notify()
+
+    def idle(self):
+        """
+        returns whether no request is waiting or being rendered
+        """
+        with self._cond:
+            return self._pending is None and not self._kept and not self._busy
+
+    def stop(self):
+        """
+        stop the worker thread once the current render finishes
+        """
+        with self._cond:
+            self._running = False
+            self._pending = None
+            self._kept.clear()
+            self._cond.notify()
+        self._thread.join()
+
+    def mean_frame_time(self):
+        return self.total_time/self.frames if self.frames else 0.0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._pending is None and not self._kept:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                if self._kept:
+                    request = self._kept.popleft()
+                else:
+                    request, self._pending = self._pending, None
+                self._busy = True
+
+            start = time.perf_counter()
+            try:
+                result = self.render(request)
+            except Exception as e:
+                result = e
+            elapsed = time.perf_counter() - start
+
+            with self._cond:
+                self.frames += 1
+                self.frame_time = elapsed
+                self.total_time += elapsed
+                self.results.put((request, result, elapsed))
+                self._busy = False
@@ -0,0 +1,133 @@
+"""
+seamless infinite zoom loops into the window of an infinite mirror image
+
+frame i of n shows the mirror image through the view H^(i/n), where H maps the
+image frame onto the window, the mirror image is unchanged by H so frame n would
+equal frame 0 and the clip loops without a seam, H^t is interpolated through the
+eigendecomposition of H and every frame is sampled straight from the source image
+
+masks are not supported: a mask shows the source through the hidden parts of each
+nested copy, so the view through H differs from the mirror image there and the
+last frame would not match the first
+"""
+import cv2
+import json
+import time, sys
+import argparse
+import collections
+import multiprocessing as mp
+from engine import RecursionEngine
+
+_engine = None
+_anim = None
+_error = None
+
+def _init_worker(imfile, window, depth, min_area, nframes):
+    # a pool replaces workers whose initializer raises, forever, so the error
+    # is kept and raised by every job the worker gets instead
+    global _engine, _anim, _error
+    try:
+        image = cv2.imread(imfile)
+        if image is None:
+            raise IOError("Could not read image: %s" % imfile)
+        _engine = RecursionEngine(image)
+        _anim = ZoomAnimation(_engine, window, depth, min_area, nframes)
+    except Exception as e:
+        _error = e
+
+def _render_worker(i):
+    if _error is not None:
+        raise _error
+    return _anim.frame(i)
+
+class ZoomAnimation:
+    """
+    The ZoomAnimation class renders the frames of an infinite zoom loop
+    """
+
+    def __init__(self, engine, window, depth=4, min_area=1.0, nframes=60):
+        self.engine = engine
+        self.window = window
+        self.nframes = nframes
+        self.hom = engine.homography(window)
+        if depth == "auto":
+            depth = engine.adaptive_depth(self.hom, min_area)
+        # zooming in by up to one level reveals one more level in the middle
+        self.depth = depth + 1
+
+    def frame(self, i):
+        """
+        returns frame i of the loop
+        """
+        view = RecursionEngine.fractional_power(self.hom, i/self.nframes)
+        mapx, mapy = self.engine.remap_tables(self.window, self.depth, view)
+        return self.engine.remap(mapx, mapy)
+
+def render_zoom(imfile, output, window, nframes=60, depth=4, min_area=1.0, fps=30.0,
+                fourcc="mp4v", processes=None, reverse=False, callback=None):
+    """
+    render an infinite zoom loop of nframes frames across a pool of worker processes,
+    frames are written to output in order as they finish, and at most two frames per
+    process are in flight at once, returns a dict of stats
+
+    callback, if given, is called with (frame number, seconds since start) per frame
+    """
+    image = cv2.imread(imfile)
+    if image is None:
+        raise IOError("Could not read image: %s" % imfile)
+    h, w = image.shape[:2]
+    del image
+    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, (w,h))
+    if not writer.isOpened():
+        raise IOError("Could not open video writer: %s" % output)
+
+    order = range(nframes-1, -1, -1) if reverse else range(nframes)
+    start = time.perf_counter()
+    initargs = (imfile, window, depth, min_area, nframes)
+    try:
+        with mp.Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+            inflight = collections.deque()
+            limit = 2*(processes or mp.cpu_count())
+            for n, i in enumerate(order):
+                inflight.append(pool.apply_async(_render_worker, (i,)))
+                if len(inflight) >= limit:
+                    writer.write(inflight.popleft().get())
+                    if callback is not None:
+                        callback(n+1-len(inflight), time.perf_counter()-start)
+            while inflight:
+                writer.write(inflight.popleft().get())
+                if callback is not None:
+                    callback(nframes-len(inflight), time.perf_counter()-start)
+    finally:
+        writer.release()
+
+    elapsed = time.perf_counter() - start
+    return {"frames": nframes, "elapsed": elapsed, "fps": nframes/elapsed if elapsed else 0.0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a seamless infinite zoom loop")
+    parser.add_argument("input", help="input image")
+    parser.add_argument("output", help="output video or printf style image sequence")
+    parser.add_argument("window", help="window quad in image pixels as json, "
+                                       "e.g. [[100,80],[300,90],[290,250],[110,240]]")
+    parser.add_argument("-n", "--frames", type=int, default=60, help="frames in the loop")
+    parser.add_argument("--depth", default="4", help="recursion depth or \"auto\"")
+    parser.add_argument("--min-area", type=float, default=1.0,
+                        help="smallest window in pixels for --depth auto")
+    parser.add_argument("--fps", type=float, default=30.0, help="output frame rate")
+    parser.add_argument("--fourcc", default="mp4v", help="output codec")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--out", action="store_true", help="zoom out instead of in")
+    args = parser.parse_args(argv)
+
+    depth = args.depth if args.depth == "auto" else int(args.depth)
+    progress = lambda n, t: print("\rframe %d/%d  %.1fs" % (n, args.frames, t), end="", flush=True)
+    stats = render_zoom(args.input, args.output, json.loads(args.window), args.frames, depth,
+                        args.min_area, args.fps, args.fourcc, args.processes,
+                        args.out, progress)
+    print("\n%d frames in %.2fs (%.1f fps)" % (stats["frames"], stats["elapsed"], stats["fps"]))
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())